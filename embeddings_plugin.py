@@ -36,6 +36,7 @@ class EmbeddingsAI:
     def unload(self):
         """Clean up resources."""
         if self._similarity_dock is not None:
+            self._similarity_dock.shutdown()
             self.iface.removeDockWidget(self._similarity_dock)
             self._similarity_dock.deleteLater()
             self._similarity_dock = None
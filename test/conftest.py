@@ -0,0 +1,6 @@
+"""Make the plugin's `tools` package importable without installing the plugin."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
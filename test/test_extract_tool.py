@@ -0,0 +1,53 @@
+"""Tests for tools/extract_tool.py; need QGIS's Python bindings, NumPy and GDAL."""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("osgeo")
+pytest.importorskip("qgis.core")
+
+from tools import extract_tool  # noqa: E402
+
+
+def _speckled_mask():
+    rng = np.random.default_rng(0)
+    mask = (rng.random((40, 50)) > 0.4).astype(np.uint8)
+    mask[5:15, 10:30] = 1
+    mask[0:3, 0:3] = 1
+    return mask
+
+
+@pytest.mark.parametrize("size", [2, 3])
+def test_open_mask_cv2_matches_numpy(monkeypatch, size):
+    cv2 = pytest.importorskip("cv2")
+    mask = _speckled_mask()
+
+    monkeypatch.setattr(extract_tool, "cv2", cv2)
+    with_cv2 = extract_tool.open_mask(mask, size)
+    monkeypatch.setattr(extract_tool, "cv2", None)
+    with_numpy = extract_tool.open_mask(mask, size)
+
+    np.testing.assert_array_equal(with_cv2, with_numpy)
+
+
+def test_contour_polygons_match_gdal_polygonize():
+    pytest.importorskip("cv2")
+    from qgis.core import QgsCoordinateReferenceSystem
+
+    mask = np.zeros((12, 12), dtype=np.uint8)
+    mask[1, 1] = 1                       # single pixel
+    mask[3, 3] = mask[4, 4] = 1          # diagonal neighbours: two polygons
+    mask[6:11, 6:11] = 1                 # block with a hole...
+    mask[8, 8] = 0
+    mask[6, 6] = 0                       # ...and a notched corner
+    geo_transform = (500000.0, 10.0, 0.0, 4000000.0, 0.0, -10.0)
+    crs = QgsCoordinateReferenceSystem("EPSG:32633")
+
+    contours = extract_tool._contour_features(mask, geo_transform)
+    polygonized = extract_tool._gdal_polygonize_features(mask, geo_transform, crs)
+
+    assert len(contours) == len(polygonized) == 4
+    assert all(f.geometry().isGeosValid() for f in contours)
+    area = sum(f.geometry().area() for f in contours)
+    assert area == pytest.approx(sum(f.geometry().area() for f in polygonized))
+    assert area == pytest.approx(mask.sum() * 100.0)
@@ -1,51 +1,87 @@
 """Canvas tools for map interactions - Point, BBox, Polygon, and Color picking."""
 
-from qgis.PyQt.QtCore import pyqtSignal, Qt
+import functools
+
+from qgis.PyQt.QtCore import pyqtSignal, Qt, QRect
 from qgis.PyQt.QtGui import QCursor, QColor
+from qgis.PyQt.QtWidgets import QApplication
 from qgis.gui import QgsMapTool, QgsRubberBand
-from qgis.core import QgsWkbTypes, QgsPointXY, QgsCoordinateTransform, QgsCoordinateReferenceSystem, QgsProject
+from qgis.core import (
+    QgsWkbTypes, QgsPointXY, QgsGeometry, QgsRectangle, QgsCoordinateTransform, QgsCoordinateReferenceSystem, QgsProject,
+)
 
+_WGS84 = QgsCoordinateReferenceSystem("EPSG:4326")
 
-class PointPickerTool(QgsMapTool):
-    """Map tool for point selection."""
-    
-    point_selected = pyqtSignal(float, float)
+_POLY = QgsWkbTypes.PolygonGeometry
+_LINE = QgsWkbTypes.LineGeometry
+
+# One cursor shared by every picker tool
+_CROSS = QCursor(Qt.CrossCursor)
+
+
+@functools.lru_cache(maxsize=32)
+def _make_transform(src_authid, src_wkt):
+    """Build a transform from the given CRS to WGS84 (cached per CRS)."""
+    return QgsCoordinateTransform(
+        QgsCoordinateReferenceSystem.fromWkt(src_wkt), _WGS84, QgsProject.instance()
+    )
+
+
+class _WGS84MapTool(QgsMapTool):
+    """Base map tool reporting coordinates in WGS84 with a cached transform."""
     
     def __init__(self, canvas):
         super().__init__(canvas)
         self.canvas = canvas
-        self.setCursor(QCursor(Qt.CrossCursor))
+        self.setCursor(_CROSS)
+        self._refresh_crs()
+        canvas.destinationCrsChanged.connect(self._refresh_crs)
+    
+    def _refresh_crs(self):
+        """Snapshot the canvas CRS; mouse events then never query map settings."""
+        self._dest_crs = self.canvas.mapSettings().destinationCrs()
+        self._needs_transform = self._dest_crs.authid() != "EPSG:4326"
+        self._xform = _make_transform(self._dest_crs.authid(), self._dest_crs.toWkt())
+    
+    def _to_wgs84(self, point):
+        if self._needs_transform:
+            return self._xform.transform(point)
+        return point
+    
+    def _ring_to_wgs84(self, points):
+        """Transform a list of vertices in one C++ call, returning (lon, lat) tuples."""
+        if not self._needs_transform:
+            return [(p.x(), p.y()) for p in points]
+        geom = QgsGeometry.fromPolygonXY([points])
+        geom.transform(self._xform)
+        # fromPolygonXY closes the ring; drop the repeated first vertex
+        return [(p.x(), p.y()) for p in geom.asPolygon()[0][:-1]]
+
+
+class PointPickerTool(_WGS84MapTool):
+    """Map tool for point selection."""
+    
+    point_selected = pyqtSignal(float, float)
     
     def canvasReleaseEvent(self, event):
         point = self.toMapCoordinates(event.pos())
         point_wgs84 = self._to_wgs84(point)
         self.point_selected.emit(point_wgs84.x(), point_wgs84.y())
-    
-    def _to_wgs84(self, point):
-        crs = self.canvas.mapSettings().destinationCrs()
-        if crs.authid() != "EPSG:4326":
-            transform = QgsCoordinateTransform(
-                crs, QgsCoordinateReferenceSystem("EPSG:4326"), QgsProject.instance()
-            )
-            return transform.transform(point)
-        return point
 
 
-class BBoxPickerTool(QgsMapTool):
+class BBoxPickerTool(_WGS84MapTool):
     """Map tool for bounding box drawing."""
     
     bbox_selected = pyqtSignal(float, float, float, float)
     
     def __init__(self, canvas):
         super().__init__(canvas)
-        self.canvas = canvas
-        self.setCursor(QCursor(Qt.CrossCursor))
         self.start_point = None
         self.rubber_band = None
     
     def canvasPressEvent(self, event):
         self.start_point = self.toMapCoordinates(event.pos())
-        self.rubber_band = QgsRubberBand(self.canvas, QgsWkbTypes.PolygonGeometry)
+        self.rubber_band = QgsRubberBand(self.canvas, _POLY)
         self.rubber_band.setColor(QColor(255, 0, 0, 100))
         self.rubber_band.setWidth(2)
     
@@ -73,20 +109,7 @@ class BBoxPickerTool(QgsMapTool):
             self.start_point = None
     
     def _update_rubber_band(self, start, end):
-        self.rubber_band.reset(QgsWkbTypes.PolygonGeometry)
-        self.rubber_band.addPoint(QgsPointXY(start.x(), start.y()), False)
-        self.rubber_band.addPoint(QgsPointXY(end.x(), start.y()), False)
-        self.rubber_band.addPoint(QgsPointXY(end.x(), end.y()), False)
-        self.rubber_band.addPoint(QgsPointXY(start.x(), end.y()), True)
-    
-    def _to_wgs84(self, point):
-        crs = self.canvas.mapSettings().destinationCrs()
-        if crs.authid() != "EPSG:4326":
-            transform = QgsCoordinateTransform(
-                crs, QgsCoordinateReferenceSystem("EPSG:4326"), QgsProject.instance()
-            )
-            return transform.transform(point)
-        return point
+        self.rubber_band.setToGeometry(QgsGeometry.fromRect(QgsRectangle(start, end)), None)
     
     def deactivate(self):
         if self.rubber_band:
@@ -95,17 +118,16 @@ class BBoxPickerTool(QgsMapTool):
         super().deactivate()
 
 
-class PolygonPickerTool(QgsMapTool):
+class PolygonPickerTool(_WGS84MapTool):
     """Map tool for polygon drawing."""
     
     polygon_selected = pyqtSignal(list)
     
     def __init__(self, canvas):
         super().__init__(canvas)
-        self.canvas = canvas
-        self.setCursor(QCursor(Qt.CrossCursor))
         self.points = []
         self.rubber_band = None
+        self.hover_band = None
     
     def canvasPressEvent(self, event):
         if event.button() == Qt.LeftButton:
@@ -113,47 +135,41 @@ class PolygonPickerTool(QgsMapTool):
             self.points.append(point)
             
             if not self.rubber_band:
-                self.rubber_band = QgsRubberBand(self.canvas, QgsWkbTypes.PolygonGeometry)
-                self.rubber_band.setColor(QColor(0, 255, 0, 100))
-                self.rubber_band.setWidth(2)
+                self.rubber_band = self._create_band(_POLY)
+                self.hover_band = self._create_band(_LINE)
             
-            self._update_rubber_band()
+            # Committed vertices are appended once; only the hover band follows the mouse
+            self.rubber_band.addPoint(point, True)
+            self._update_hover_band(point)
             
         elif event.button() == Qt.RightButton:
             if len(self.points) >= 3:
-                wgs84_points = [self._to_wgs84(p) for p in self.points]
-                coords = [(p.x(), p.y()) for p in wgs84_points]
+                coords = self._ring_to_wgs84(self.points)
                 self.polygon_selected.emit(coords)
             self._reset()
     
     def canvasMoveEvent(self, event):
-        if self.rubber_band and self.points:
-            temp_point = self.toMapCoordinates(event.pos())
-            self._update_rubber_band(temp_point)
-    
-    def _update_rubber_band(self, temp_point=None):
-        self.rubber_band.reset(QgsWkbTypes.PolygonGeometry)
-        for p in self.points:
-            self.rubber_band.addPoint(QgsPointXY(p.x(), p.y()), False)
-        if temp_point:
-            self.rubber_band.addPoint(QgsPointXY(temp_point.x(), temp_point.y()), False)
-        if self.points:
-            self.rubber_band.addPoint(QgsPointXY(self.points[0].x(), self.points[0].y()), True)
+        if self.hover_band and self.points:
+            self._update_hover_band(self.toMapCoordinates(event.pos()))
     
-    def _to_wgs84(self, point):
-        crs = self.canvas.mapSettings().destinationCrs()
-        if crs.authid() != "EPSG:4326":
-            transform = QgsCoordinateTransform(
-                crs, QgsCoordinateReferenceSystem("EPSG:4326"), QgsProject.instance()
-            )
-            return transform.transform(point)
-        return point
+    def _update_hover_band(self, cursor):
+        # Hover preview: last vertex -> cursor -> first vertex
+        line = [QgsPointXY(self.points[-1]), QgsPointXY(cursor), QgsPointXY(self.points[0])]
+        self.hover_band.setToGeometry(QgsGeometry.fromPolylineXY(line), None)
+    
+    def _create_band(self, geometry_type):
+        band = QgsRubberBand(self.canvas, geometry_type)
+        band.setColor(QColor(0, 255, 0, 100))
+        band.setWidth(2)
+        return band
     
     def _reset(self):
         self.points = []
-        if self.rubber_band:
-            self.canvas.scene().removeItem(self.rubber_band)
-            self.rubber_band = None
+        for band in (self.rubber_band, self.hover_band):
+            if band:
+                self.canvas.scene().removeItem(band)
+        self.rubber_band = None
+        self.hover_band = None
     
     def deactivate(self):
         self._reset()
@@ -168,14 +184,11 @@ class ColorPickerTool(QgsMapTool):
     def __init__(self, canvas):
         super().__init__(canvas)
         self.canvas = canvas
-        self.setCursor(QCursor(Qt.CrossCursor))
+        self.setCursor(_CROSS)
     
     def canvasReleaseEvent(self, event):
         point = event.pos()
         
-        from qgis.PyQt.QtCore import QRect
-        from qgis.PyQt.QtWidgets import QApplication
-        
         try:
             pixmap = self.canvas.grab(QRect(point.x(), point.y(), 1, 1))
             image = pixmap.toImage()
@@ -185,14 +198,13 @@ class ColorPickerTool(QgsMapTool):
                 self.color_picked.emit(color)
         except Exception:
             try:
-                screen = QApplication.screenAt(self.canvas.mapToGlobal(point))
+                global_point = self.canvas.mapToGlobal(point)
+                screen = QApplication.screenAt(global_point)
                 if screen:
-                    pixmap = screen.grabWindow(
-                        0, self.canvas.mapToGlobal(point).x(), 
-                        self.canvas.mapToGlobal(point).y(), 1, 1
-                    )
+                    # Grab from the desktop; winId() would force a native canvas window
+                    pixmap = screen.grabWindow(0, global_point.x(), global_point.y(), 1, 1)
                     image = pixmap.toImage()
                     color = image.pixelColor(0, 0)
                     self.color_picked.emit(color)
-            except:
+            except Exception:
                 pass
@@ -0,0 +1,452 @@
+"""Color-based mask extraction from rendered map images."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal, gdal_array, ogr, osr
+from qgis.PyQt.QtGui import QImage, QPainter
+from qgis.core import (
+    QgsVectorLayer, QgsFeature, QgsGeometry, QgsFeatureSink, QgsMapLayerType, QgsPalettedRasterRenderer,
+    QgsMapRendererCustomPainterJob,
+)
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# sRGB byte -> linear light, and linear RGB -> XYZ scaled by the D65 white point
+_SRGB_TO_LINEAR = np.array(
+    [c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in np.arange(256) / 255.0],
+    dtype=np.float32,
+)
+_RGB_TO_XYZ_D65 = (np.array([
+    [0.412453, 0.357580, 0.180423],
+    [0.212671, 0.715160, 0.072169],
+    [0.019334, 0.119193, 0.950227],
+]) / np.array([[0.950456], [1.0], [1.088754]])).astype(np.float32)
+
+# Rows per band for the NumPy kernels: 64 rows of a 2000 px render is 512 KB of
+# BGRA input, keeping each band's temporaries within L2
+BAND_ROWS = 64
+# Below this height the thread start-up costs more than the bands save
+PARALLEL_MIN_ROWS = 256
+
+# Images with at most this many distinct BGRA values (classified or categorical
+# renders) are matched once per color and the result gathered per pixel
+PALETTE_MAX_COLORS = 4096
+
+_LAB_LUT = None
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _lab_f_jit(t):
+        if t > 0.008856:
+            return t ** (1.0 / 3.0)
+        return 7.787 * t + 16.0 / 116.0
+
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _lab_distance_jit(bgra, lin, m, target_lab, out):
+        """Per-pixel LAB conversion and distance, fused and parallel over rows.
+
+        Branch-free per pixel: transparency is folded into one predicated
+        store, so LLVM can vectorize the row loop.
+        """
+        height, width = out.shape
+        for y in prange(height):
+            for x in range(width):
+                r = lin[bgra[y, x, 2]]
+                g = lin[bgra[y, x, 1]]
+                b = lin[bgra[y, x, 0]]
+                fx = _lab_f_jit(m[0, 0] * r + m[0, 1] * g + m[0, 2] * b)
+                fy = _lab_f_jit(m[1, 0] * r + m[1, 1] * g + m[1, 2] * b)
+                fz = _lab_f_jit(m[2, 0] * r + m[2, 1] * g + m[2, 2] * b)
+                lab_l = int(min(max((116.0 * fy - 16.0) * 2.55, 0.0), 255.0) + 0.5)
+                lab_a = int(min(max(500.0 * (fx - fy) + 128.0, 0.0), 255.0) + 0.5)
+                lab_b = int(min(max(200.0 * (fy - fz) + 128.0, 0.0), 255.0) + 0.5)
+                distance = max(abs(lab_l - target_lab[0]), abs(lab_a - target_lab[1]),
+                               abs(lab_b - target_lab[2]))
+                out[y, x] = max(distance, 255 * (bgra[y, x, 3] == 0))
+else:
+    _lab_distance_jit = None
+
+
+def render_to_bgra(settings):
+    """Render `settings` into a NumPy-owned (H, W, 4) B, G, R, A buffer.
+
+    The painter draws straight into the array through a QImage wrapper, so
+    there is no renderer-side compositing image and no copy out of it. The
+    output is premultiplied, like a regular map render.
+    """
+    size = settings.outputSize()
+    width, height = size.width(), size.height()
+    # ARGB32 pixels are native-endian 0xAARRGGBB words: B, G, R, A bytes on
+    # little-endian hosts. Zeroed memory is the transparent background.
+    bgra = np.zeros((height, width, 4), dtype=np.uint8)
+    image = QImage(bgra.data, width, height, width * 4, QImage.Format_ARGB32_Premultiplied)
+    painter = QPainter(image)
+    try:
+        job = QgsMapRendererCustomPainterJob(settings, painter)
+        job.start()
+        job.waitForFinished()
+    finally:
+        painter.end()
+    return bgra
+
+
+def _map_row_bands(band_kernel, image, *args, halo=0):
+    """Fill a uint8 (H, W) array by running `band_kernel` over BAND_ROWS-row slices.
+
+    Each band's temporaries (channel casts, deltas, distances) stay cache-sized
+    instead of being full-image arrays streamed through DRAM once per operation.
+    Bands are disjoint, so they run on a thread pool (NumPy and OpenCV release
+    the GIL inside their loops) without any locking. Kernels that look at
+    neighbouring rows get `halo` extra rows on each side, cropped afterwards.
+    """
+    height = image.shape[0]
+    out = np.empty(image.shape[:2], dtype=np.uint8)
+
+    def run_band(y0):
+        y1 = min(y0 + BAND_ROWS, height)
+        start = max(y0 - halo, 0)
+        result = band_kernel(image[start:y1 + halo], *args)
+        out[y0:y1] = result[y0 - start:y1 - start]
+
+    starts = range(0, height, BAND_ROWS)
+    if height < PARALLEL_MIN_ROWS:
+        for y0 in starts:
+            run_band(y0)
+    else:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(run_band, starts))
+    return out
+
+
+def _lab_f(t):
+    return np.where(t > 0.008856, np.cbrt(t), 7.787 * t + 16.0 / 116.0)
+
+
+def rgb_to_lab8(rgb):
+    """Convert (..., 3) uint8 RGB to 8-bit LAB with OpenCV's scaling (L*255/100, a+128, b+128)."""
+    if cv2 is not None:
+        flat = np.ascontiguousarray(rgb, dtype=np.uint8).reshape(1, -1, 3)
+        return cv2.cvtColor(flat, cv2.COLOR_RGB2LAB).reshape(rgb.shape)
+
+    xyz = _SRGB_TO_LINEAR[rgb] @ _RGB_TO_XYZ_D65.T
+    fx, fy, fz = (_lab_f(xyz[..., i]) for i in range(3))
+    lab = np.empty(rgb.shape, dtype=np.float32)
+    lab[..., 0] = (116.0 * fy - 16.0) * 255.0 / 100.0
+    lab[..., 1] = 500.0 * (fx - fy) + 128.0
+    lab[..., 2] = 200.0 * (fy - fz) + 128.0
+    return np.clip(np.rint(lab), 0, 255).astype(np.uint8)
+
+
+def _lab_lut():
+    """RGB -> LAB table over 6-bit cubes, built on first use.
+
+    Entry (r >> 2 << 12 | g >> 2 << 6 | b >> 2) holds the LAB of that cube's
+    center: 768 KB, within about one RGB step of the exact conversion.
+    """
+    global _LAB_LUT
+    if _LAB_LUT is None:
+        levels = np.arange(2, 256, 4, dtype=np.uint8)
+        grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1)
+        _LAB_LUT = rgb_to_lab8(grid).reshape(-1, 3)
+    return _LAB_LUT
+
+
+def _lab_distance_band(bgra, target_lab):
+    if cv2 is not None:
+        lab = rgb_to_lab8(bgra[..., 2::-1])
+    else:
+        index = ((bgra[..., 2] >> 2).astype(np.int32) << 12) | ((bgra[..., 1] >> 2).astype(np.int32) << 6) \
+            | (bgra[..., 0] >> 2)
+        lab = np.take(_lab_lut(), index, axis=0)
+    distance = np.abs(lab.astype(np.int16) - target_lab).max(axis=-1).astype(np.uint8)
+    distance[bgra[..., 3] == 0] = 255
+    return distance
+
+
+def lab_distance_map(bgra, target_rgb):
+    """Return the per-pixel LAB distance to the target as uint8.
+
+    The distance is the largest per-channel difference (so thresholding it is a
+    LAB box test); transparent pixels get 255. Uses OpenCV's conversion when
+    installed, a Numba kernel when Numba is, and a quantized RGB -> LAB lookup
+    table otherwise.
+    """
+    target_lab = rgb_to_lab8(np.array([target_rgb], dtype=np.uint8))[0].astype(np.int16)
+
+    if cv2 is None and _lab_distance_jit is not None:
+        distance = np.empty(bgra.shape[:2], dtype=np.uint8)
+        _lab_distance_jit(bgra, _SRGB_TO_LINEAR, _RGB_TO_XYZ_D65, target_lab, distance)
+        return distance
+
+    return _map_row_bands(_lab_distance_band, bgra, target_lab)
+
+
+def _pack_bgra(bgra):
+    """Pack B, G, R, A bytes into the 0xAARRGGBB words QImage stores."""
+    return ((bgra[..., 3].astype(np.uint32) << 24) | (bgra[..., 2].astype(np.uint32) << 16)
+            | (bgra[..., 1].astype(np.uint32) << 8) | bgra[..., 0])
+
+
+def exact_color_mask(bgra, target_rgb):
+    """Mask non-transparent pixels whose RGB equals the target exactly: one
+    compare per 32-bit word instead of the distance arithmetic."""
+    try:
+        words = bgra.view(np.uint32)[..., 0]
+    except ValueError:
+        words = _pack_bgra(bgra)
+    r_target, g_target, b_target = target_rgb
+    target_word = (r_target << 16) | (g_target << 8) | b_target
+    return (((words & 0xFFFFFF) == target_word) & ((words >> 24) != 0)).astype(np.uint8)
+
+
+def _match_by_palette(bgra, match):
+    """Run `match` on the distinct colors only and gather its result per pixel.
+
+    Returns None when the image has more than PALETTE_MAX_COLORS colors; a
+    strided sample rejects continuous renders before the full unique() sort.
+    """
+    words = _pack_bgra(bgra)
+    if np.unique(words[::8, ::8]).size > PALETTE_MAX_COLORS:
+        return None
+    colors, inverse = np.unique(words, return_inverse=True)
+    if colors.size > PALETTE_MAX_COLORS:
+        return None
+    # Sorted uint32 words viewed as bytes are B, G, R, A again (little-endian)
+    lut = match(colors.view(np.uint8).reshape(1, -1, 4))[0]
+    return lut[inverse].reshape(bgra.shape[:2])
+
+
+def color_distance_map(bgra, target_rgb):
+    """LAB distance map (see lab_distance_map), computed once per distinct color
+    for classified renders. Independent of the tolerance, so one map serves any
+    number of thresholds through distance_mask."""
+    def distance(pixels):
+        return lab_distance_map(pixels, target_rgb)
+
+    result = _match_by_palette(bgra, distance)
+    return result if result is not None else distance(bgra)
+
+
+def distance_mask(distance, threshold_dist):
+    """Mask a color_distance_map: a LAB box whose corners lie on a sphere of
+    radius `threshold_dist` (transparent pixels, at 255, never match)."""
+    return (distance <= threshold_dist / 3 ** 0.5).astype(np.uint8)
+
+
+def _threshold_open_band(distance, threshold_dist, size):
+    return open_mask(distance_mask(distance, threshold_dist), size)
+
+
+def clean_distance_mask(distance, threshold_dist, size):
+    """distance_mask followed by open_mask, fused per row band so each band's
+    mask is opened while it is still in cache. Bands carry a halo wide enough
+    for erosion plus dilation, so the result equals the two full-image passes.
+    """
+    if size < 2:
+        return distance_mask(distance, threshold_dist)
+    return _map_row_bands(_threshold_open_band, distance, threshold_dist, size, halo=2 * size)
+
+
+def perceptual_match_mask(bgra, target_rgb, threshold_dist):
+    """Mask pixels perceptually close to the target color.
+
+    A zero threshold means an exact RGB match. Otherwise this is a LAB box
+    whose corners lie on a sphere of radius `threshold_dist`.
+    """
+    if threshold_dist >= 1:
+        return distance_mask(color_distance_map(bgra, target_rgb), threshold_dist)
+
+    def match(pixels):
+        return exact_color_mask(pixels, target_rgb)
+
+    mask = _match_by_palette(bgra, match)
+    return mask if mask is not None else match(bgra)
+
+
+def paletted_raster_mask(layer, extent, crs, width, height, target_rgb, threshold_dist):
+    """Mask a GDAL-backed paletted raster straight from its class values.
+
+    The class colors are matched once, then the band is warped (nearest
+    neighbour) onto the output grid and tested with isin; no symbology is
+    rendered. Returns None for any other layer, which the caller renders.
+    """
+    if layer.type() != QgsMapLayerType.RasterLayer or layer.providerType() != 'gdal':
+        return None
+    renderer = layer.renderer()
+    if not isinstance(renderer, QgsPalettedRasterRenderer):
+        return None
+
+    classes = renderer.classes()
+    if not classes:
+        return None
+    class_bgra = np.array(
+        [[c.color.blue(), c.color.green(), c.color.red(), 255] for c in classes], dtype=np.uint8
+    ).reshape(1, -1, 4)
+    matched = perceptual_match_mask(class_bgra, target_rgb, threshold_dist)[0].astype(bool)
+    values = np.array([c.value for c in classes])[matched]
+
+    # Anything GDAL cannot open or reproject falls back to rendering the layer
+    try:
+        warped = gdal.Warp(
+            '', layer.source(), format='MEM', width=width, height=height,
+            outputBounds=(extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()),
+            dstSRS=crs.toWkt(), resampleAlg='near', dstAlpha=True,
+        )
+        if warped is None or renderer.band() >= warped.RasterCount:
+            return None
+        band = warped.GetRasterBand(renderer.band()).ReadAsArray()
+        # The added alpha band marks cells the source actually covers
+        covered = warped.GetRasterBand(warped.RasterCount).ReadAsArray()
+    except (RuntimeError, OSError):
+        return None
+    if band is None or covered is None:
+        return None
+    return (np.isin(band, values) & (covered != 0)).astype(np.uint8)
+
+
+def open_mask(mask, size):
+    """Morphological opening with a `size` x `size` square: drops specks and
+    strands thinner than `size` pixels before they become polygons. A size
+    below 2 returns the mask unchanged."""
+    if size < 2:
+        return mask
+    # Erode then dilate with mirrored anchors so even sizes don't shift the mask
+    before, after = (size - 1) // 2, size // 2
+    if cv2 is not None:
+        kernel = np.ones((size, size), dtype=np.uint8)
+        eroded = cv2.erode(mask, kernel, anchor=(before, before), borderType=cv2.BORDER_REPLICATE)
+        return cv2.dilate(eroded, kernel, anchor=(after, after), borderType=cv2.BORDER_REPLICATE)
+
+    from numpy.lib.stride_tricks import sliding_window_view
+    # Edge padding leaves borders alone
+    padded = np.pad(mask, ((before, after), (before, after)), mode='edge')
+    eroded = sliding_window_view(padded, (size, size)).min(axis=(2, 3))
+    padded = np.pad(eroded, ((after, before), (after, before)), mode='edge')
+    return sliding_window_view(padded, (size, size)).max(axis=(2, 3))
+
+
+def _ring_wkb(contour, origin, geo_transform):
+    """WKB ring bytes for an OpenCV contour traced on a component's corner lattice.
+
+    Lattice point p sits on cell corner origin + p / 2. 8-connected tracing
+    cuts the corner pixel at concave turns as a diagonal step; the corner is
+    the step's intermediate with both coordinates even, so it is put back.
+    """
+    points = contour.reshape(-1, 2) - 1
+    following = np.roll(points, -1, axis=0)
+    diagonal = (points[:, 0] != following[:, 0]) & (points[:, 1] != following[:, 1])
+    corners = np.where(points % 2 == 0, points, following)[diagonal]
+    slots = np.arange(len(points)) + np.cumsum(diagonal) - diagonal
+    ring = np.empty((len(points) + len(corners), 2), dtype=points.dtype)
+    ring[slots] = points
+    ring[slots[diagonal] + 1] = corners
+    # Drop the vertices left in the middle of straight runs
+    before, after = ring - np.roll(ring, 1, axis=0), np.roll(ring, -1, axis=0) - ring
+    ring = ring[before[:, 0] * after[:, 1] != before[:, 1] * after[:, 0]]
+
+    coords = np.empty((len(ring) + 1, 2), dtype='<f8')
+    coords[:-1, 0] = geo_transform[0] + (origin[0] + ring[:, 0] * 0.5) * geo_transform[1]
+    coords[:-1, 1] = geo_transform[3] + (origin[1] + ring[:, 1] * 0.5) * geo_transform[5]
+    coords[-1] = coords[0]
+    return np.uint32(len(coords)).astype('<u4').tobytes() + coords.tobytes()
+
+
+def _contour_features(mask, geo_transform):
+    """Trace mask regions (with holes) with cv2.findContours into QgsFeatures.
+
+    Regions are 4-connected like gdal.Polygonize's: each component is drawn
+    on its own lattice where cell (r, c) covers points 2r..2r+2, so traced
+    pixel centres land on cell edges, and diagonal neighbours from other
+    components never merge into a self-touching ring. Each polygon's WKB is
+    assembled with NumPy and parsed once by QGIS.
+    """
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+    kernel = np.ones((3, 3), dtype=np.uint8)
+
+    features = []
+    for label in range(1, count):
+        x, y, w, h = stats[label, :4]
+        # One zero point of padding all round keeps the rings off the image border
+        lattice = np.zeros((2 * h + 3, 2 * w + 3), dtype=np.uint8)
+        lattice[2:-1:2, 2:-1:2] = labels[y:y + h, x:x + w] == label
+        lattice = cv2.dilate(lattice, kernel)
+        contours, hierarchy = cv2.findContours(lattice, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        # hierarchy rows are [next, previous, first_child, parent]; with RETR_CCOMP the
+        # top level holds the outer boundary and its children are the holes
+        hierarchy = hierarchy[0]
+        for i, (_, _, child, parent) in enumerate(hierarchy):
+            if parent != -1:
+                continue
+            rings = [_ring_wkb(contours[i], (x, y), geo_transform)]
+            while child != -1:
+                rings.append(_ring_wkb(contours[child], (x, y), geo_transform))
+                child = hierarchy[child][0]
+            # Little-endian Polygon: byte order, type 3, ring count, rings
+            wkb = b'\x01' + np.array([3, len(rings)], dtype='<u4').tobytes() + b''.join(rings)
+            geometry = QgsGeometry()
+            geometry.fromWkb(wkb)
+            feature = QgsFeature()
+            feature.setGeometry(geometry)
+            features.append(feature)
+    return features
+
+
+def _gdal_polygonize_features(mask, geo_transform, crs):
+    """Trace mask regions with gdal.Polygonize into QgsFeatures, fully in memory.
+
+    The raster side is a GDAL view of the NumPy mask itself, so the mask is
+    never duplicated.
+    """
+    raster_ds = gdal_array.OpenArray(mask)
+    raster_ds.SetGeoTransform(geo_transform)
+    band = raster_ds.GetRasterBand(1)
+
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(crs.toWkt())
+    vector_ds = ogr.GetDriverByName('Memory').CreateDataSource('')
+    vector_layer = vector_ds.CreateLayer('polygons', srs=srs, geom_type=ogr.wkbPolygon)
+    vector_layer.CreateField(ogr.FieldDefn('value', ogr.OFTInteger))
+    # Using the band as its own mask skips the background (zero) cells
+    gdal.Polygonize(band, band, vector_layer, 0, [], callback=None)
+
+    features = []
+    for ogr_feature in vector_layer:
+        geometry = QgsGeometry()
+        geometry.fromWkb(ogr_feature.GetGeometryRef().ExportToWkb())
+        feature = QgsFeature()
+        feature.setGeometry(geometry)
+        features.append(feature)
+    return features
+
+
+def polygonize_features(mask, geo_transform, crs):
+    """Polygonize the non-zero cells of a uint8 mask into QgsFeatures.
+
+    Uses OpenCV contour tracing when available and gdal.Polygonize otherwise;
+    both run entirely in memory and keep holes. Touches no layers or widgets,
+    so it is safe to call from a background task.
+    """
+    mask = np.ascontiguousarray(mask, dtype=np.uint8)
+    if cv2 is not None:
+        return _contour_features(mask, geo_transform)
+    return _gdal_polygonize_features(mask, geo_transform, crs)
+
+
+def polygon_layer(features, crs, name):
+    """Wrap polygon features in a new QGIS memory layer."""
+    layer = QgsVectorLayer("Polygon", name, "memory")
+    layer.setCrs(crs)
+    layer.dataProvider().addFeatures(features, QgsFeatureSink.FastInsert)
+    layer.updateExtents()
+    return layer
@@ -1,64 +1,180 @@
 """Google Earth Engine integration for AlphaEarth similarity search."""
 
-ee = None
+import math
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import ee
+    _EE_AVAILABLE = True
+except ImportError:
+    ee = None
+    _EE_AVAILABLE = False
+
+_gdal = None
+
+_EE_MISSING_MESSAGE = (
+    "Google Earth Engine plugin is required. "
+    "Please install from QGIS Plugin Manager and connect your Google Cloud Project."
+)
+
+ALPHAEARTH_COLLECTION = 'GOOGLE/SATELLITE_EMBEDDING/V1/ANNUAL'
+
+# The AlphaEarth annual embeddings always expose the same 64 bands (A00..A63),
+# so there is no need to ask Earth Engine for them on every search.
+ALPHAEARTH_BANDS = [f"A{i:02d}" for i in range(64)]
+
+ALPHAEARTH_NATIVE_SCALE = 10  # meters
+
+# Reference regions are averaged over roughly this many pixels at most; more
+# samples do not change a 64-D mean meaningfully but cost reducer time.
+REFERENCE_TARGET_PIXELS = 4096
+REFERENCE_MIN_SCALE = 30  # meters
+
+# Built search results kept per (geometry, parameters); they are lazy EE
+# objects, so an entry is only a few small Python objects
+RESULT_CACHE_SIZE = 64
+# Reference embeddings kept per (geometry, year range): 64 floats each
+TARGET_CACHE_SIZE = 256
+
+_DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Regions larger than this many pixels are downloaded as a grid of tiles
+# (single getDownloadURL requests are capped at ~48 MB by Earth Engine)
+_TILE_MAX_PIXELS = 4_000_000
+_TILE_DOWNLOAD_WORKERS = 8
+
+_session = None
+
+
+def _get_session():
+    """Shared HTTP session so repeated exports reuse pooled TLS connections."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        _session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    return _session
+
+
+def _get_gdal():
+    """Import GDAL once, on first use, so driver registration is paid only once."""
+    global _gdal
+    if _gdal is None:
+        from osgeo import gdal
+        _gdal = gdal
+    return _gdal
+
+
+# Geometry payloads, all in WGS84 degrees. Polygon coords are a tuple of
+# (lon, lat) tuples so every payload is hashable.
+PointData = namedtuple("PointData", "lon lat")
+Bbox = namedtuple("Bbox", "min_lon min_lat max_lon max_lat")
+PolyData = namedtuple("PolyData", "coords")
+
+
+def _trim_cache(cache, max_size, keep):
+    """Drop the oldest entries (dicts keep insertion order) until `cache` holds at
+    most `max_size`, never evicting keys in `keep`."""
+    excess = len(cache) - max_size
+    if excess <= 0:
+        return
+    for key in [key for key in cache if key not in keep][:excess]:
+        del cache[key]
+
+
+def _geometry_key(geom_type, geom_data):
+    """Hashable key for a geometry payload."""
+    return geom_type, geom_data
 
 
 class GEESimilaritySearch:
     """Similarity search engine using GEE AlphaEarth embeddings."""
     
+    # Shared by all instances: ee.Initialize() runs the credential flow once per session
+    _initialized = False
+    
     def __init__(self):
-        self._initialized = False
+        # Reference embeddings keyed by (geometry, year range); re-running a search
+        # with other display parameters skips the reduceRegion round-trip
+        self._target_cache = {}
+        # Built results keyed by (geometry, search parameters)
+        self._result_cache = {}
     
     def _ensure_initialized(self):
-        """Initialize GEE with lazy import."""
-        global ee
-        
-        if ee is None:
-            try:
-                import ee as _ee
-                ee = _ee
-            except ImportError:
-                raise RuntimeError(
-                    "Google Earth Engine plugin is required. "
-                    "Please install from QGIS Plugin Manager and connect your Google Cloud Project."
-                )
-        
-        if not self._initialized:
-            try:
-                ee.Initialize()
-                self._initialized = True
-            except Exception as e:
-                raise RuntimeError(f"Unable to initialize Google Earth Engine: {e}")
+        """Initialize GEE once per QGIS session."""
+        if GEESimilaritySearch._initialized:
+            return
+        
+        if not _EE_AVAILABLE:
+            raise RuntimeError(_EE_MISSING_MESSAGE)
+        
+        try:
+            ee.Initialize()
+            GEESimilaritySearch._initialized = True
+        except Exception as e:
+            raise RuntimeError(f"Unable to initialize Google Earth Engine: {e}")
     
-    def run_similarity_search_geometry(self, geom_type, geom_data, buffer_km=5, 
-                                        year_start=2023, year_end=None, max_threshold=0.5):
-        """Run similarity search for any geometry type.
-        
-        Returns dict with: similarity_image, search_area, reference_geom, vis_params, geom_type
-        """
-        self._ensure_initialized()
-        
-        if year_end is None:
-            year_end = year_start
+    def _reduce_target(self, geom_type, reference_geom, embeddings_image):
+        """Server-side reduction of the reference geometry to its 64-D embedding."""
+        if geom_type == 'point':
+            # A point covers a single pixel: read it at native resolution, no mean pass
+            return embeddings_image.reduceRegion(
+                reducer=ee.Reducer.first(),
+                geometry=reference_geom,
+                scale=ALPHAEARTH_NATIVE_SCALE,
+            )
         
+        # Coarsen the sampling scale with the region area (computed server-side,
+        # no extra round-trip) so large polygons are reduced over ~4k pixels
+        scale = ee.Number(reference_geom.area(1)) \
+            .divide(REFERENCE_TARGET_PIXELS).sqrt().max(REFERENCE_MIN_SCALE)
+        return embeddings_image.reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=reference_geom,
+            scale=scale,
+            maxPixels=1e9,
+            bestEffort=True  # Allow GEE to use approximations for speed
+        )
+    
+    @staticmethod
+    def _target_from_values(target_values, year_start):
+        """Order fetched band values; an empty mosaic reduces to nulls, so this
+        doubles as the coverage check (no separate size() probe)."""
+        target_values = target_values or {}
+        if any(target_values.get(band) is None for band in ALPHAEARTH_BANDS):
+            raise RuntimeError(
+                f"No AlphaEarth embeddings found for this location and year ({year_start}). "
+                f"AlphaEarth coverage may be limited. Try a different location or year (2017-2023)."
+            )
+        return [target_values[band] for band in ALPHAEARTH_BANDS]
+    
+    def _prepare_search(self, geom_type, geom_data, buffer_km, year_start, year_end):
+        """Build the (lazy) EE objects for one geometry; no network traffic."""
         if geom_type == 'point':
-            reference_geom = ee.Geometry.Point([geom_data['lon'], geom_data['lat']])
+            reference_geom = ee.Geometry.Point([geom_data.lon, geom_data.lat])
             # Use square bounding box instead of circular buffer
             buffer_degrees = buffer_km / 111.0  # Approximate km to degrees
             search_area = ee.Geometry.Rectangle([
-                geom_data['lon'] - buffer_degrees,
-                geom_data['lat'] - buffer_degrees,
-                geom_data['lon'] + buffer_degrees,
-                geom_data['lat'] + buffer_degrees
+                geom_data.lon - buffer_degrees,
+                geom_data.lat - buffer_degrees,
+                geom_data.lon + buffer_degrees,
+                geom_data.lat + buffer_degrees
             ])
         elif geom_type == 'bbox':
-            reference_geom = ee.Geometry.Rectangle([
-                geom_data['min_lon'], geom_data['min_lat'],
-                geom_data['max_lon'], geom_data['max_lat']
-            ])
+            reference_geom = ee.Geometry.Rectangle(list(geom_data))
             search_area = reference_geom
         elif geom_type == 'polygon':
-            reference_geom = ee.Geometry.Polygon([geom_data['coords']])
+            reference_geom = ee.Geometry.Polygon([[list(c) for c in geom_data.coords]])
             search_area = reference_geom
         else:
             raise ValueError(f"Unknown geometry type: {geom_type}")
@@ -66,42 +182,30 @@ class GEESimilaritySearch:
         start_date = f"{year_start}-01-01"
         end_date = f"{year_end + 1}-01-01"
         
-        embeddings = ee.ImageCollection('GOOGLE/SATELLITE_EMBEDDING/V1/ANNUAL') \
+        embeddings = ee.ImageCollection(ALPHAEARTH_COLLECTION) \
             .filterDate(start_date, end_date) \
             .filterBounds(search_area)
         
-        # Check if we have any embeddings
-        if embeddings.size().getInfo() == 0:
-            raise RuntimeError(
-                f"No AlphaEarth embeddings found for this location and year ({year_start}). "
-                f"AlphaEarth coverage may be limited. Try a different location or year (2017-2023)."
-            )
-        
-        embeddings_image = embeddings.mosaic()
-        
-        target_vector = embeddings_image.reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=reference_geom,
-            scale=30,  # Optimized: 30m instead of 10m (9x fewer pixels)
-            maxPixels=1e9,
-            bestEffort=True  # Allow GEE to use approximations for speed
-        )
-        
-        # Verify we got embedding values
-        band_names = embeddings_image.bandNames().getInfo()
-        if not band_names or len(band_names) == 0:
-            raise RuntimeError(
-                "No embedding bands found. The reference location may be outside AlphaEarth coverage."
-            )
-        
-        target_image = target_vector.toImage(band_names)
+        return {
+            'geom_type': geom_type,
+            'reference_geom': reference_geom,
+            'search_area': search_area,
+            'embeddings_image': embeddings.mosaic(),
+            'cache_key': (_geometry_key(geom_type, geom_data), year_start, year_end),
+        }
+    
+    def _build_result(self, search, target, max_threshold, resolution=None):
+        target_image = ee.Image.constant(target).rename(ALPHAEARTH_BANDS)
         
-        diff = embeddings_image.subtract(target_image)
-        squared_diff = diff.pow(2)
-        sum_squared_diff = squared_diff.reduce(ee.Reducer.sum())
-        euclidean_distance = sum_squared_diff.sqrt()
+        # AlphaEarth embeddings are unit-length, so ||a - b||^2 = 1 + ||b||^2 - 2 a.b.
+        # ||b||^2 is known client-side, leaving a single per-pixel dot product
+        # instead of subtract + pow + sum. max(0) absorbs rounding below zero.
+        target_norm_sq = sum(v * v for v in target)
+        dot = search['embeddings_image'].multiply(target_image).reduce(ee.Reducer.sum())
+        # float32 halves tile and download bytes; distances need no double precision
+        euclidean_distance = dot.multiply(-2).add(1 + target_norm_sq).max(0).sqrt().toFloat()
         
-        similarity_image = euclidean_distance.clip(search_area)
+        similarity_image = euclidean_distance.clip(search['search_area'])
         
         vis_params = {
             'min': 0,
@@ -109,27 +213,125 @@ class GEESimilaritySearch:
             'palette': ['#00FF00', '#FFFF00', '#FF0000']
         }
         
-        return {
+        result = {
             'similarity_image': similarity_image,
-            'search_area': search_area,
-            'reference_geom': reference_geom,
+            'search_area': search['search_area'],
+            'reference_geom': search['reference_geom'],
             'vis_params': vis_params,
-            'geom_type': geom_type,
+            'geom_type': search['geom_type'],
         }
+        if resolution is not None:
+            # Display copy at the requested grid, built into the same graph; the
+            # unprojected image stays available for exports at other scales
+            result['display_image'] = similarity_image.reproject(crs='EPSG:4326', scale=resolution)
+        return result
+    
+    def run_similarity_search_geometry(self, geom_type, geom_data, buffer_km=5, 
+                                        year_start=2023, year_end=None, max_threshold=0.5):
+        """Run similarity search for any geometry type.
+        
+        Returns dict with: similarity_image, search_area, reference_geom, vis_params, geom_type
+        """
+        result = self.run_similarity_search_batch(
+            [(geom_type, geom_data)], buffer_km, year_start, year_end, max_threshold
+        )[0]
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        return result
+    
+    @staticmethod
+    def _fetch_targets(reductions):
+        """getInfo() a list of reductions in one round-trip.
+        
+        If the combined request fails (one bad geometry fails the whole list),
+        each reduction is fetched on its own; failures come back as exceptions
+        in place of values.
+        """
+        try:
+            return ee.List(reductions).getInfo()
+        except Exception:
+            fetched = []
+            for reduction in reductions:
+                try:
+                    fetched.append(reduction.getInfo())
+                except Exception as e:
+                    fetched.append(e)
+            return fetched
+    
+    def run_similarity_search_batch(self, geometries, buffer_km=5, year_start=2023, year_end=None,
+                                    max_threshold=0.5, resolution=None):
+        """Run similarity search for several (geom_type, geom_data) pairs at once.
+        
+        All reference embeddings not already cached are fetched in a single
+        getInfo() round-trip, so N geometries cost one network wait instead of N.
+        Returns one result dict per input, in order (see run_similarity_search_geometry).
+        A geometry whose reference embedding cannot be read (e.g. outside the
+        AlphaEarth footprint) gets {'error': message, 'geom_type': ...} instead;
+        the others are unaffected.
+        With `resolution` (meters), each result also carries `display_image`, the
+        similarity image reprojected to EPSG:4326 at that scale.
+        """
+        self._ensure_initialized()
+        
+        if year_end is None:
+            year_end = year_start
+        
+        params = (buffer_km, year_start, year_end, max_threshold, resolution)
+        
+        # Duplicate geometries (same point clicked twice, identical boxes) are
+        # prepared once and share the result; unchanged re-runs hit the cache
+        keys = [(_geometry_key(geom_type, geom_data), params) for geom_type, geom_data in geometries]
+        searches = {}
+        for key, (geom_type, geom_data) in zip(keys, geometries):
+            if key not in self._result_cache and key not in searches:
+                searches[key] = self._prepare_search(geom_type, geom_data, buffer_km, year_start, year_end)
+        
+        pending = {}
+        for search in searches.values():
+            if search['cache_key'] not in self._target_cache and search['cache_key'] not in pending:
+                pending[search['cache_key']] = self._reduce_target(
+                    search['geom_type'], search['reference_geom'], search['embeddings_image']
+                )
+        
+        failures = {}
+        if pending:
+            target_keys = list(pending)
+            for key, fetched in zip(target_keys, self._fetch_targets([pending[key] for key in target_keys])):
+                try:
+                    if isinstance(fetched, Exception):
+                        raise fetched
+                    self._target_cache[key] = self._target_from_values(fetched, year_start)
+                except Exception as e:
+                    # Not cached, so a later run retries this geometry
+                    failures[key] = str(e)
+        
+        # This batch's results are collected locally, so trimming the shared
+        # caches afterwards can never drop something about to be returned
+        batch = {key: self._result_cache[key] for key in keys if key in self._result_cache}
+        built = {}
+        for key, search in searches.items():
+            if search['cache_key'] in failures:
+                batch[key] = {'error': failures[search['cache_key']], 'geom_type': search['geom_type']}
+            else:
+                built[key] = batch[key] = self._build_result(
+                    search, self._target_cache[search['cache_key']], max_threshold, resolution
+                )
+        
+        self._result_cache.update(built)
+        _trim_cache(self._result_cache, RESULT_CACHE_SIZE, batch)
+        _trim_cache(self._target_cache, TARGET_CACHE_SIZE, {search['cache_key'] for search in searches.values()})
+        
+        # Shallow copies: callers may annotate their result dict
+        return [dict(batch[key]) for key in keys]
     
     def run_similarity_search(self, lon, lat, buffer_km=5, year=2023, max_threshold=0.5, shape="circle"):
         """Legacy method for backward compatibility."""
         if shape == "square":
             half_side_deg = buffer_km / 111.0
-            geom_data = {
-                'min_lon': lon - half_side_deg,
-                'min_lat': lat - half_side_deg,
-                'max_lon': lon + half_side_deg,
-                'max_lat': lat + half_side_deg
-            }
+            geom_data = Bbox(lon - half_side_deg, lat - half_side_deg, lon + half_side_deg, lat + half_side_deg)
             result = self.run_similarity_search_geometry('bbox', geom_data, buffer_km, year, max_threshold)
         else:
-            geom_data = {'lon': lon, 'lat': lat}
+            geom_data = PointData(lon, lat)
             result = self.run_similarity_search_geometry('point', geom_data, buffer_km, year, max_threshold)
         
         result['point_source'] = result['reference_geom']
@@ -150,10 +352,8 @@ def export_gee_image_to_file(ee_image, geometry, file_path, scale, vis_params, c
         color_palette: List of color hex codes
         export_format: 'geotiff', 'cog', or 'png'
     """
-    global ee
-    if ee is None:
-        import ee as _ee
-        ee = _ee
+    if not _EE_AVAILABLE:
+        raise RuntimeError(_EE_MISSING_MESSAGE)
     
     # Export RAW similarity values (not visualized)
     # This preserves the original 0-threshold range for proper coloring in QGIS
@@ -163,75 +363,41 @@ def export_gee_image_to_file(ee_image, geometry, file_path, scale, vis_params, c
     
     # Clip to geometry and get download URL
     try:
-        url = image_to_export.clip(geometry).getDownloadURL({
-            'scale': scale,
-            'crs': 'EPSG:4326',
-            'fileFormat': file_format,
-            'region': geometry.getInfo()['coordinates'] if geometry.type().getInfo() == 'Polygon' else geometry.bounds().getInfo()['coordinates']
-        })
+        # Download rasters always cover the region's bounding box and the image
+        # is already clipped to the geometry, so the bounds alone are enough:
+        # one small round-trip instead of a type probe plus coordinates.
+        region = geometry.bounds().getInfo()['coordinates']
         
-        # Download file
-        import requests
-        import time
+        target_ext = '.tif' if export_format in ['geotiff', 'cog'] else '.png'
+        clipped = image_to_export.clip(geometry)
         
         print(f"Downloading from GEE... (scale={scale}m)")
         start_time = time.time()
         
-        response = requests.get(url, timeout=120)  # 2 minute timeout
-        response.raise_for_status()
-        
-        # GEE often returns ZIP files, so we need to handle that
-        content_type = response.headers.get('Content-Type', '')
-        is_zip = 'zip' in content_type or response.content.startswith(b'PK')
+        # Large GeoTIFF regions are split into a tile grid fetched in parallel
+        grid = _tile_grid_size(region[0], scale) if target_ext == '.tif' else 1
+        if grid > 1:
+            downloaded = _download_tiles(clipped, region[0], scale, grid, file_path)
+        else:
+            url = clipped.getDownloadURL({
+                'scale': scale,
+                'crs': 'EPSG:4326',
+                'fileFormat': file_format,
+                'region': region
+            })
+            downloaded = _download_url_to_file(url, file_path, target_ext)
         
         elapsed = time.time() - start_time
-        file_size_mb = len(response.content) / (1024 * 1024)
+        file_size_mb = downloaded / (1024 * 1024)
         print(f"Downloaded {file_size_mb:.2f} MB in {elapsed:.1f} seconds")
         
-        if is_zip:
-            print("Response is a ZIP file, extracting...")
-            import zipfile
-            import io
-            import tempfile
-            import os
-            
-            # Extract ZIP content
-            zip_buffer = io.BytesIO(response.content)
-            with zipfile.ZipFile(zip_buffer) as zip_file:
-                # Find the first .tif or .png file in the ZIP
-                target_ext = '.tif' if export_format in ['geotiff', 'cog'] else '.png'
-                tif_files = [name for name in zip_file.namelist() if name.endswith(target_ext)]
-                
-                if not tif_files:
-                    raise RuntimeError(f"No {target_ext} file found in downloaded ZIP")
-                
-                # Extract to a temporary location first
-                temp_dir = tempfile.mkdtemp()
-                extracted_file = zip_file.extract(tif_files[0], temp_dir)
-                
-                # Read the extracted file and write to final destination
-                with open(extracted_file, 'rb') as src:
-                    with open(file_path, 'wb') as dst:
-                        dst.write(src.read())
-                
-                # Clean up temp directory
-                import shutil
-                shutil.rmtree(temp_dir)
-                
-            print(f"Extracted {target_ext} file from ZIP to {file_path}")
-        else:
-            # Direct file, write as-is
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            print(f"Saved file directly to {file_path}")
-        
         # For COG format, convert using GDAL
         if export_format == 'cog':
             _convert_to_cog(file_path)
         
         # For PNG, create world file
         if export_format == 'png':
-            _create_world_file(file_path, geometry)
+            _create_world_file(file_path, region[0])
         
         return file_path
         
@@ -239,43 +405,164 @@ def export_gee_image_to_file(ee_image, geometry, file_path, scale, vis_params, c
         raise RuntimeError(f"GEE export failed: {str(e)}")
 
 
-def _convert_to_cog(file_path):
-    """Convert GeoTIFF to Cloud Optimized GeoTIFF."""
+def _download_url_to_file(url, file_path, target_ext):
+    """Stream a GEE download URL to file_path, unpacking ZIP responses.
+    
+    Returns the number of bytes downloaded.
+    """
+    response = _get_session().get(url, stream=True, timeout=120)  # 2 minute timeout
+    response.raise_for_status()
+    
+    # Stream to a temp file next to the destination so the payload is never
+    # held in memory and a non-ZIP response can simply be moved into place
+    with tempfile.NamedTemporaryFile(
+        suffix='.download', dir=os.path.dirname(file_path) or None, delete=False
+    ) as tmp:
+        download_path = tmp.name
+        downloaded = 0
+        for chunk in response.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+            tmp.write(chunk)
+            downloaded += len(chunk)
+    
     try:
-        from osgeo import gdal
-        import tempfile
-        import os
+        # GEE often returns ZIP files, so we need to handle that
+        content_type = response.headers.get('Content-Type', '')
+        is_zip = 'zip' in content_type or zipfile.is_zipfile(download_path)
         
-        # Create temp file
-        temp_path = file_path.replace('.tif', '_temp.tif')
-        os.rename(file_path, temp_path)
+        if is_zip:
+            with zipfile.ZipFile(download_path) as zip_file:
+                # Find the first .tif or .png file in the ZIP
+                tif_files = [name for name in zip_file.namelist() if name.endswith(target_ext)]
+                
+                if not tif_files:
+                    raise RuntimeError(f"No {target_ext} file found in downloaded ZIP")
+                
+                # Chunked copy straight from the archive to the destination
+                with zip_file.open(tif_files[0]) as src, open(file_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, length=_DOWNLOAD_CHUNK_SIZE)
+        else:
+            # Direct file, move into place as-is
+            os.replace(download_path, file_path)
+    finally:
+        if os.path.exists(download_path):
+            os.remove(download_path)
+    
+    return downloaded
+
+
+def _tile_grid_size(bounds, scale):
+    """Number of tiles per side needed to keep each download under the pixel budget."""
+    xs, ys = zip(*bounds)
+    # Approximate meters per degree; good enough to size the request
+    width_px = (max(xs) - min(xs)) * 111320.0 / scale
+    height_px = (max(ys) - min(ys)) * 111320.0 / scale
+    return max(1, math.ceil(math.sqrt(width_px * height_px / _TILE_MAX_PIXELS)))
+
+
+def _download_tiles(ee_image, bounds, scale, grid, file_path):
+    """Download ee_image as a grid x grid mosaic of tiles in parallel.
+    
+    All tiles share one pixel grid anchored at the region's top-left corner, so
+    they meet without overlaps or seams. Download URLs are requested on the
+    calling thread; only the HTTP transfers run concurrently over the shared
+    session, and the tiles are stitched into a single GeoTIFF at file_path
+    through a GDAL VRT. Returns the bytes downloaded.
+    """
+    gdal = _get_gdal()
+    
+    xs, ys = zip(*bounds)
+    min_x, max_y = min(xs), max(ys)
+    pixel_deg = scale / 111320.0
+    width_px = max(1, math.ceil((max(xs) - min_x) / pixel_deg))
+    height_px = max(1, math.ceil((max_y - min(ys)) / pixel_deg))
+    # Whole-pixel tile boundaries, so neighbouring tiles split the grid exactly
+    col_edges = [round(i * width_px / grid) for i in range(grid + 1)]
+    row_edges = [round(i * height_px / grid) for i in range(grid + 1)]
+    
+    urls = []
+    for row in range(grid):
+        for col in range(grid):
+            urls.append(ee_image.getDownloadURL({
+                'crs': 'EPSG:4326',
+                'crs_transform': [
+                    pixel_deg, 0, min_x + col_edges[col] * pixel_deg,
+                    0, -pixel_deg, max_y - row_edges[row] * pixel_deg,
+                ],
+                'dimensions': [col_edges[col + 1] - col_edges[col], row_edges[row + 1] - row_edges[row]],
+                'fileFormat': 'GeoTIFF',
+            }))
+    
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(file_path) or None)
+    
+    def fetch(index):
+        tile_path = os.path.join(temp_dir, f"tile_{index}.tif")
+        return tile_path, _download_url_to_file(urls[index], tile_path, '.tif')
+    
+    try:
+        with ThreadPoolExecutor(max_workers=_TILE_DOWNLOAD_WORKERS) as executor:
+            results = list(executor.map(fetch, range(len(urls))))
+        
+        vrt_path = os.path.join(temp_dir, 'mosaic.vrt')
+        vrt = gdal.BuildVRT(vrt_path, [path for path, _ in results])
+        if vrt is None:
+            raise RuntimeError(gdal.GetLastErrorMsg() or "Could not mosaic downloaded tiles")
+        vrt = None  # Flush the VRT before translating it
+        
+        out = gdal.Translate(file_path, vrt_path, format='GTiff', creationOptions=['COMPRESS=LZW', 'TILED=YES'])
+        if out is None:
+            raise RuntimeError(gdal.GetLastErrorMsg() or "Could not write mosaicked GeoTIFF")
+        out = None
+        
+        return sum(size for _, size in results)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _convert_to_cog(file_path):
+    """Convert GeoTIFF to Cloud Optimized GeoTIFF.
+    
+    Uses GDAL's native COG driver (GDAL >= 3.1), which writes tiles and internal
+    overviews in one pass, into a side file that atomically replaces the input.
+    """
+    cog_path = file_path + '.cog.tif'
+    try:
+        gdal = _get_gdal()
         
-        # Convert to COG
-        gdal.Translate(
+        result = gdal.Translate(
+            cog_path,
             file_path,
-            temp_path,
-            creationOptions=['TILED=YES', 'COMPRESS=LZW', 'COPY_SRC_OVERVIEWS=YES']
+            format='COG',
+            # PREDICTOR=YES lets the driver pick the floating-point predictor for Float32 bands
+            creationOptions=[
+                'COMPRESS=DEFLATE', 'PREDICTOR=YES', 'BLOCKSIZE=512',
+                'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER',
+            ]
         )
+        if result is None:
+            raise RuntimeError(gdal.GetLastErrorMsg() or "gdal.Translate returned no dataset")
+        result = None  # Close the dataset to flush it to disk
         
-        # Clean up
-        os.remove(temp_path)
+        os.replace(cog_path, file_path)
         print("Converted to Cloud Optimized GeoTIFF")
         
     except Exception as e:
         print(f"COG conversion failed, keeping as regular GeoTIFF: {e}")
-        # If conversion fails, just rename temp back
-        if os.path.exists(temp_path):
-            os.rename(temp_path, file_path)
+        if os.path.exists(cog_path):
+            os.remove(cog_path)
 
 
-def _create_world_file(png_path, geometry):
-    """Create world file (.pgw) for PNG."""
+def _create_world_file(png_path, bounds):
+    """Create world file (.pgw) for PNG.
+    
+    Args:
+        png_path: Path of the exported PNG
+        bounds: Exterior ring of the export region's bounding box, as fetched
+            for the download request (list of [lon, lat] pairs)
+    """
     try:
-        bounds = geometry.bounds().getInfo()['coordinates'][0]
-        min_x = min(p[0] for p in bounds)
-        max_x = max(p[0] for p in bounds)
-        min_y = min(p[1] for p in bounds)
-        max_y = max(p[1] for p in bounds)
+        xs, ys = zip(*bounds)
+        min_x, max_x = min(xs), max(xs)
+        min_y, max_y = min(ys), max(ys)
         
         # Assume standard 512x512 image from GEE
         width = 512
@@ -284,14 +571,12 @@ def _create_world_file(png_path, geometry):
         pixel_size_x = (max_x - min_x) / width
         pixel_size_y = (max_y - min_y) / height
         
+        # Pixel size X, rotation X, rotation Y, pixel size Y (negative), upper left X, upper left Y
+        body = f"{pixel_size_x}\n0.0\n0.0\n-{pixel_size_y}\n{min_x}\n{max_y}\n"
+        
         world_file = png_path.replace('.png', '.pgw')
         with open(world_file, 'w') as f:
-            f.write(f"{pixel_size_x}\n")     # Pixel size X
-            f.write("0.0\n")                 # Rotation X
-            f.write("0.0\n")                 # Rotation Y  
-            f.write(f"-{pixel_size_y}\n")   # Pixel size Y (negative)
-            f.write(f"{min_x}\n")            # Upper left X
-            f.write(f"{max_y}\n")            # Upper left Y
+            f.write(body)
         
         print(f"Created world file: {world_file}")
         
@@ -1,26 +1,75 @@
 """Main widget for QGIS Embeddings AI plugin - Similarity Search Dock."""
 
-from qgis.PyQt.QtCore import Qt
+import math
+from collections import namedtuple
+
+from qgis.PyQt.QtCore import Qt, QTimer, QObject, QThread, QUrl, QSize, pyqtSignal
+from qgis.PyQt.QtNetwork import QNetworkRequest, QNetworkReply
 from qgis.PyQt.QtWidgets import (
     QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QGroupBox,
     QDoubleSpinBox, QListWidget, QListWidgetItem, QComboBox, QAbstractItemView,
-    QTabWidget, QFrame, QSlider, QSpinBox, QScrollArea, QToolButton,
+    QTabWidget, QFrame, QSlider, QSpinBox, QScrollArea, QToolButton, QListView,
 )
 from qgis.PyQt.QtGui import QFont, QColor
 from qgis.core import (
     QgsProject, QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY,
     QgsSingleSymbolRenderer, QgsMarkerSymbol, QgsFillSymbol, QgsRasterLayer,
-    QgsMessageLog, Qgis,
+    QgsMessageLog, Qgis, QgsFeatureSink, QgsRectangle, QgsDataSourceUri, QgsNetworkAccessManager,
+    QgsMapLayerType, QgsRasterDataProvider, QgsCoordinateTransform, QgsCsException, QgsTask, QgsApplication,
 )
 from qgis.gui import QgsColorButton
 
 from .canvas_tool import PointPickerTool, BBoxPickerTool, PolygonPickerTool, ColorPickerTool
-from .gee_tool import GEESimilaritySearch
+from .gee_tool import GEESimilaritySearch, PointData, Bbox, PolyData, _EE_MISSING_MESSAGE
+
+try:
+    from ee_plugin import Map
+    _EE_AVAILABLE = True
+except ImportError:
+    Map = None
+    _EE_AVAILABLE = False
+
+# Search threads still running when their dock was unloaded; referenced here
+# until they finish so they are never destroyed while running
+_detached_threads = set()
+
+# Snapshot of a list item taken before a search run
+GeomTask = namedtuple("GeomTask", "geom_type geom_data geom_name layer_id")
+
+
+class GEESearchWorker(QObject):
+    """Runs a batched similarity search on a worker thread.
+    
+    Only Earth Engine calls happen here; results are handed back through
+    `finished` so layers are still created on the GUI thread.
+    """
+    
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(object)  # list of result dicts, one per task
+    error = pyqtSignal(str)
+    
+    def __init__(self, gee_search, tasks, params):
+        super().__init__()
+        self.gee_search = gee_search
+        self.tasks = tasks
+        self.params = params
+    
+    def run(self):
+        try:
+            self.progress.emit(f"Processing {len(self.tasks)} geometries ({self.params['year_start']})...")
+            results = self.gee_search.run_similarity_search_batch(
+                [(task.geom_type, task.geom_data) for task in self.tasks], **self.params
+            )
+            self.finished.emit(results)
+        except Exception as e:
+            self.error.emit(str(e))
 
 
 class GeometryItem(QListWidgetItem):
     """Custom list item for geometry data."""
     
+    _PREFIXES = {'point': '[P]', 'bbox': '[B]', 'polygon': '[G]'}
+    
     def __init__(self, geom_type, data, name="", layer_id=None):
         super().__init__()
         self.geom_type = geom_type
@@ -31,75 +80,94 @@ class GeometryItem(QListWidgetItem):
         self.setFlags(self.flags() | Qt.ItemIsEditable)
     
     def _update_display(self):
-        prefixes = {'point': '[P]', 'bbox': '[B]', 'polygon': '[G]'}
-        prefix = prefixes.get(self.geom_type, '[?]')
+        prefix = self._PREFIXES.get(self.geom_type, '[?]')
         self.setText(f"{prefix} {self.geom_name}")
     
     def setData(self, role, value):
-        super().setData(role, value)
-        if role == Qt.EditRole:
-            text = value
-            for prefix in ['[P]', '[B]', '[G]', '[?]']:
-                if text.startswith(prefix):
-                    text = text[len(prefix):].strip()
-                    break
-            self.geom_name = text
-            self._update_display()
+        if role != Qt.EditRole:
+            super().setData(role, value)
+            return
+        
+        text = value
+        # Display prefixes are all "[X]"; strip one if the user kept it
+        if isinstance(text, str) and len(text) >= 3 and text[0] == '[' and text[2] == ']':
+            text = text[3:].strip()
+        if text == self.geom_name:
+            # Unchanged name: the display text is already right, emit nothing
+            return
+        self.geom_name = text
+        # setText stores the edit/display text and notifies the list once
+        self._update_display()
 
 
 class SimilaritySearchWidget(QDockWidget):
     """Dockable panel for QGIS Embeddings AI similarity search."""
 
-    STYLE_TOOL_NORMAL = """
-        QPushButton {
+    # One stylesheet set on the dock; buttons pick their look through dynamic
+    # properties so toggling a tool flips a property instead of re-parsing QSS.
+    STYLESHEET = """
+        QPushButton[toolRole="normal"] {
             background-color: #4a4a4a; color: #e0e0e0;
             padding: 8px 12px; border-radius: 4px;
             border: 1px solid #5a5a5a; min-width: 60px;
         }
-        QPushButton:hover { background-color: #5a5a5a; }
-    """
-    
-    STYLE_TOOL_ACTIVE = """
-        QPushButton {
+        QPushButton[toolRole="normal"]:hover { background-color: #5a5a5a; }
+        
+        QPushButton[toolRole="active"] {
             background-color: #5c7a99; color: white; font-weight: bold;
             padding: 8px 12px; border-radius: 4px;
             border: 2px solid #7a9bb8; min-width: 60px;
         }
-        QPushButton:hover { background-color: #6d8aa8; }
-    """
-    
-    STYLE_ACTION_PRIMARY = """
-        QPushButton {
+        QPushButton[toolRole="active"]:hover { background-color: #6d8aa8; }
+        
+        QPushButton[actionRole="primary"] {
             background-color: #6b89a8; color: white; font-weight: bold;
             padding: 10px; border-radius: 4px;
         }
-        QPushButton:hover { background-color: #7a9bb8; }
-        QPushButton:disabled { background-color: #3a3a3a; color: #888888; }
-    """
-    
-    STYLE_ACTION_SECONDARY = """
-        QPushButton {
+        QPushButton[actionRole="primary"]:hover { background-color: #7a9bb8; }
+        QPushButton[actionRole="primary"]:disabled { background-color: #3a3a3a; color: #888888; }
+        
+        QPushButton[actionRole="secondary"] {
             background-color: #4a5a6a; 
             color: white; 
             font-weight: normal;
             padding: 10px; 
             border-radius: 4px;
         }
-        QPushButton:hover { background-color: #5a6a7a; }
-        QPushButton:disabled { background-color: #2a2a2a; color: #666666; }
-    """
-    
-    STYLE_BASEMAP_BTN = """
-        QPushButton {
+        QPushButton[actionRole="secondary"]:hover { background-color: #5a6a7a; }
+        QPushButton[actionRole="secondary"]:disabled { background-color: #2a2a2a; color: #666666; }
+        
+        QPushButton[actionRole="basemap"] {
             background-color: #5a6a7a; color: white; font-weight: bold;
             padding: 8px; border-radius: 4px;
         }
-        QPushButton:hover { background-color: #6a7a8a; }
+        QPushButton[actionRole="basemap"]:hover { background-color: #6a7a8a; }
     """
     
-    PREVIEW_COLOR_POINT = "#7a9bb8"
-    PREVIEW_COLOR_BBOX = "#8a9aa8"
-    PREVIEW_COLOR_POLYGON = "#6a8a9a"
+    PREVIEW_COLOR_POINT = QColor("#7a9bb8")
+    PREVIEW_COLOR_BBOX = QColor("#8a9aa8")
+    PREVIEW_COLOR_POLYGON = QColor("#6a8a9a")
+    
+    # Long-edge render size for color extraction. Render, matching and polygonize
+    # cost all scale with pixel count, and polygon vertex density with resolution.
+    EXTRACT_QUALITY_PRESETS = [("Fast", 512), ("Balanced", 1024), ("Precise", 2000)]
+    EXTRACT_MAX_DIM = 1024
+    # Default opening size for extraction masks; specks below it are dropped
+    EXTRACT_OPEN_SIZE = 2
+    
+    _TYPE_NAMES = {'point': 'Point', 'bbox': 'BBox', 'polygon': 'Polygon'}
+    
+    # XYZ provider URIs, tried in order ('&' inside the tile URL is pre-encoded)
+    BASEMAP_URIS = [
+        ("Google Satellite",
+         "type=xyz&url=https://mt1.google.com/vt/lyrs=s%26x={x}%26y={y}%26z={z}&zmax=20&zmin=0"),
+        ("ESRI World Imagery",
+         "type=xyz&url=https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
+         "&zmax=19&zmin=0"),
+    ]
+    
+    # How long unload waits for an in-flight search before detaching it
+    SHUTDOWN_WAIT_MS = 2000
     
     YEAR_MIN = 2017
     YEAR_MAX = 2023
@@ -111,25 +179,76 @@ class SimilaritySearchWidget(QDockWidget):
         self.canvas = iface.mapCanvas()
         
         self.current_tool = None
+        self._active_tool_obj = None
         self.previous_map_tool = None
         self.gee_search = GEESimilaritySearch()
         self.geometry_counter = {'point': 0, 'bbox': 0, 'polygon': 0}
         self.preview_layers = {}
+        # Preview layer id -> list item, so layer removals resolve in O(1)
+        self._layer_to_item = {}
+        # Ids of the result layers we added, so toggling never scans the project
+        self._similarity_layer_ids = set()
+        self._zone_reference_layer_ids = set()
+        
+        # Renames are collected and applied to the preview layers on the next
+        # event-loop pass, so a burst of edits renames each layer only once
+        self._pending_renames = {}
+        self._rename_timer = QTimer(self)
+        self._rename_timer.setSingleShot(True)
+        self._rename_timer.setInterval(0)
+        self._rename_timer.timeout.connect(self._flush_renames)
+        
+        # Status messages are coalesced: only the latest one per 50 ms is painted
+        self._pending_status = None
+        self._status_timer = QTimer(self)
+        self._status_timer.setSingleShot(True)
+        self._status_timer.setInterval(50)
+        self._status_timer.timeout.connect(self._flush_status)
         
         self.point_tool = None
         self.bbox_tool = None
         self.polygon_tool = None
+        # tool type -> (class, selection signal, handler, status hint)
+        self._tool_factories = {
+            'point': (PointPickerTool, 'point_selected', self._on_point_added,
+                      "Click on the map to add a point"),
+            'bbox': (BBoxPickerTool, 'bbox_selected', self._on_bbox_added,
+                     "Draw a bounding box on the map"),
+            'polygon': (PolygonPickerTool, 'polygon_selected', self._on_polygon_added,
+                        "Click vertices, right-click to finish"),
+        }
+        
+        # In-flight basemap probes, in BASEMAP_URIS order: [reply, ok] (ok None while pending)
+        self._basemap_probes = []
+        
+        # Background search, if one is running
+        self._search_thread = None
+        self._search_worker = None
+        self._search_context = None
         
         # Track last search result for export
         self.last_search_result = None
         self.last_search_name = None
         self.last_search_params = None
         
+        # Extraction widgets and the color picker are only built on first use
+        self._extract_tab = None
+        self.color_picker_tool = None
+        # Background extraction, if one is running
+        self._extract_task = None
+        # Last extraction render, reused while layer, extent and size are unchanged
+        self._render_cache = None
+        self._render_cache_layer = None
+        # (render array, target rgb, LAB distance map) of the last tolerance extraction
+        self._distance_cache = None
+        
         self.setAllowedAreas(Qt.LeftDockWidgetArea | Qt.RightDockWidgetArea)
         self.setMinimumWidth(320)
+        self.setStyleSheet(self.STYLESHEET)
         
+        self._build_symbol_templates()
         self._setup_ui()
-        QgsProject.instance().layerWillBeRemoved.connect(self._on_layer_removed_from_qgis)
+        QgsProject.instance().layersWillBeRemoved.connect(self._on_layers_removed_from_qgis)
     
     def _setup_ui(self):
         """Build the user interface."""
@@ -160,7 +279,7 @@ class SimilaritySearchWidget(QDockWidget):
         basemap_group = QGroupBox("Basemap")
         basemap_layout = QHBoxLayout(basemap_group)
         self.btn_add_basemap = QPushButton("Import Map")
-        self.btn_add_basemap.setStyleSheet(self.STYLE_BASEMAP_BTN)
+        self.btn_add_basemap.setProperty("actionRole", "basemap")
         self.btn_add_basemap.setToolTip("Import Google Satellite as reference")
         self.btn_add_basemap.clicked.connect(self._on_add_basemap_clicked)
         basemap_layout.addWidget(self.btn_add_basemap)
@@ -175,7 +294,7 @@ class SimilaritySearchWidget(QDockWidget):
         tools_row = QHBoxLayout()
         self.btn_point = QPushButton("Add Point")
         self.btn_point.setCheckable(True)
-        self.btn_point.setStyleSheet(self.STYLE_TOOL_NORMAL)
+        self.btn_point.setProperty("toolRole", "normal")
         self.btn_point.setToolTip("Click on map to add a reference point")
         self.btn_point.clicked.connect(lambda: self._on_tool_clicked('point'))
         tools_row.addWidget(self.btn_point)
@@ -204,6 +323,11 @@ class SimilaritySearchWidget(QDockWidget):
         # Geometries List (hidden but functional)
         self.list_geometries = QListWidget()
         self.list_geometries.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        # Single-line rows: let the view lay items out in batches with one uniform size
+        self.list_geometries.setUniformItemSizes(True)
+        self.list_geometries.setLayoutMode(QListView.Batched)
+        self.list_geometries.setBatchSize(64)
+        self.list_geometries.setResizeMode(QListView.Adjust)
         self.list_geometries.itemChanged.connect(self._on_geometry_renamed)
         self.list_geometries.hide()
         self.btn_remove = QPushButton("Remove Selected")
@@ -214,14 +338,14 @@ class SimilaritySearchWidget(QDockWidget):
         
         self.btn_run = QPushButton("Search Similarity")
         self.btn_run.setEnabled(False)
-        self.btn_run.setStyleSheet(self.STYLE_ACTION_PRIMARY)
+        self.btn_run.setProperty("actionRole", "primary")
         self.btn_run.setMinimumHeight(40)
         self.btn_run.clicked.connect(self._on_run_clicked)
         buttons_row.addWidget(self.btn_run)
         
         self.btn_export = QPushButton("Export Results")
         self.btn_export.setEnabled(False)
-        self.btn_export.setStyleSheet(self.STYLE_ACTION_SECONDARY)
+        self.btn_export.setProperty("actionRole", "secondary")
         self.btn_export.setMinimumHeight(40)
         self.btn_export.setToolTip("Download similarity results as local file")
         self.btn_export.clicked.connect(self._on_export_clicked)
@@ -293,7 +417,18 @@ class SimilaritySearchWidget(QDockWidget):
         self.btn_toggle_similarity.hide()
         search_layout.addStretch()
         
-        # === EXTRACT TAB (hidden) ===
+        # Status
+        self.label_status = QLabel("Status: Ready")
+        status_font = QFont()
+        status_font.setItalic(True)
+        self.label_status.setFont(status_font)
+        main_layout.addWidget(self.label_status)
+    
+    def _ensure_extract_tab(self):
+        """Build the (hidden) extraction widgets the first time they are needed."""
+        if self._extract_tab is not None:
+            return self._extract_tab
+        
         extract_tab = QWidget()
         extract_layout = QVBoxLayout(extract_tab)
         extract_layout.setSpacing(12)
@@ -321,7 +456,8 @@ class SimilaritySearchWidget(QDockWidget):
         tol_row = QHBoxLayout()
         tol_row.addWidget(QLabel("Tolerance:"))
         self.slider_color_tolerance = QSlider(Qt.Horizontal)
-        self.slider_color_tolerance.setRange(1, 100)
+        self.slider_color_tolerance.setRange(0, 100)
+        self.slider_color_tolerance.setToolTip("0 matches the exact color only")
         self.slider_color_tolerance.setValue(30)
         self.slider_color_tolerance.valueChanged.connect(self._on_tolerance_changed)
         tol_row.addWidget(self.slider_color_tolerance)
@@ -339,128 +475,199 @@ class SimilaritySearchWidget(QDockWidget):
         layer_row.addWidget(self.btn_refresh_layers)
         extract_group_layout.addLayout(layer_row)
         
+        quality_row = QHBoxLayout()
+        quality_row.addWidget(QLabel("Quality:"))
+        self.combo_extract_quality = QComboBox()
+        for label, max_dim in self.EXTRACT_QUALITY_PRESETS:
+            self.combo_extract_quality.addItem(f"{label} ({max_dim} px)", max_dim)
+        self.combo_extract_quality.setCurrentIndex(self.combo_extract_quality.findData(self.EXTRACT_MAX_DIM))
+        self.combo_extract_quality.setToolTip("Resolution used for extraction; higher is more detailed but slower")
+        quality_row.addWidget(self.combo_extract_quality)
+        extract_group_layout.addLayout(quality_row)
+        
+        clean_row = QHBoxLayout()
+        clean_row.addWidget(QLabel("Min. width:"))
+        self.spin_open_size = QSpinBox()
+        self.spin_open_size.setRange(1, 10)
+        self.spin_open_size.setValue(self.EXTRACT_OPEN_SIZE)
+        self.spin_open_size.setSuffix(" px")
+        self.spin_open_size.setToolTip(
+            "Drop matches thinner than this before vectorizing (fewer tiny polygons); 1 keeps every pixel"
+        )
+        clean_row.addWidget(self.spin_open_size)
+        clean_row.addStretch()
+        extract_group_layout.addLayout(clean_row)
+        
         extract_layout.addWidget(extract_group)
         
         self.btn_extract = QPushButton("Extract Polygons")
-        self.btn_extract.setStyleSheet(self.STYLE_ACTION_PRIMARY)
+        self.btn_extract.setProperty("actionRole", "primary")
         self.btn_extract.setMinimumHeight(40)
         self.btn_extract.clicked.connect(self._on_extract_clicked)
         extract_layout.addWidget(self.btn_extract)
         extract_layout.addStretch()
         
-        # Status
-        self.label_status = QLabel("Status: Ready")
-        status_font = QFont()
-        status_font.setItalic(True)
-        self.label_status.setFont(status_font)
-        main_layout.addWidget(self.label_status)
-        
-        self.color_picker_tool = ColorPickerTool(self.canvas)
-        self.color_picker_tool.color_picked.connect(self._on_color_picked_from_map)
+        self._extract_tab = extract_tab
+        return extract_tab
     
     def _on_add_basemap_clicked(self):
-        """Add Google Satellite basemap."""
+        """Add Google Satellite basemap, falling back to ESRI imagery.
+        
+        Every provider's zoom-0 tile is requested at once through the QGIS network
+        manager; the first provider in BASEMAP_URIS order that answers is added,
+        so an unreachable server never blocks the UI.
+        """
+        if self._basemap_probes:
+            return
+        
+        nam = QgsNetworkAccessManager.instance()
+        for index, (name, uri) in enumerate(self.BASEMAP_URIS):
+            tile_url = QgsDataSourceUri(uri).param("url")
+            for placeholder in ("{x}", "{y}", "{z}"):
+                tile_url = tile_url.replace(placeholder, "0")
+            reply = nam.get(QNetworkRequest(QUrl(tile_url)))
+            reply.finished.connect(lambda index=index: self._on_basemap_probe_finished(index))
+            self._basemap_probes.append([reply, None])
+        
+        self.btn_add_basemap.setEnabled(False)
+        self._set_status("Checking basemap servers...")
+    
+    def _on_basemap_probe_finished(self, index):
+        probe = self._basemap_probes[index]
+        reply = probe[0]
+        probe[1] = (
+            reply.error() == QNetworkReply.NoError
+            and reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 200
+        )
+        
+        # Decide in priority order; wait while a preferred provider is pending
+        for (name, uri), (_, ok) in zip(self.BASEMAP_URIS, self._basemap_probes):
+            if ok is None:
+                return
+            if ok:
+                self._finish_basemap_probes()
+                self._add_basemap_layer(name, uri)
+                return
+        
+        self._finish_basemap_probes()
+        self.iface.messageBar().pushWarning("QGIS Embeddings AI", "Could not load basemap.")
+    
+    def _finish_basemap_probes(self):
+        """Abort probes still in flight and release every reply."""
+        probes, self._basemap_probes = self._basemap_probes, []
+        for reply, ok in probes:
+            if ok is None:
+                reply.finished.disconnect()
+                reply.abort()
+            reply.deleteLater()
+        self.btn_add_basemap.setEnabled(True)
+    
+    def _add_basemap_layer(self, name, uri):
         try:
-            basemaps = [
-                {'name': 'Google Satellite', 'url': 'https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}', 'zmax': 20},
-                {'name': 'ESRI World Imagery', 'url': 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', 'zmax': 19}
-            ]
-            
-            for basemap_info in basemaps:
-                url_encoded = basemap_info['url'].replace('&', '%26')
-                uri = f"type=xyz&url={url_encoded}&zmax={basemap_info['zmax']}&zmin=0"
-                layer = QgsRasterLayer(uri, basemap_info['name'], "wms")
-                
-                if layer.isValid():
-                    QgsProject.instance().addMapLayer(layer)
-                    self.canvas.refresh()
-                    self._set_status(f"Added {basemap_info['name']}")
-                    return
-            
-            self.iface.messageBar().pushWarning("QGIS Embeddings AI", "Could not load basemap.")
+            layer = QgsRasterLayer(uri, name, "wms")
+            if layer.isValid():
+                QgsProject.instance().addMapLayer(layer)
+                self.canvas.refresh()
+                self._set_status(f"Added {name}")
+            else:
+                self.iface.messageBar().pushWarning("QGIS Embeddings AI", "Could not load basemap.")
         except Exception as e:
             self.iface.messageBar().pushCritical("QGIS Embeddings AI", f"Basemap error: {str(e)}")
     
-    def _create_preview_layer(self, geom_type, geom_data, name):
-        """Create preview layer for geometry."""
+    def _build_symbol_templates(self):
+        """Parse the preview and extraction symbols once; each new layer gets a clone."""
+        self._tpl_point_symbol = QgsMarkerSymbol.createSimple({
+            'name': 'circle', 'size': '4', 'outline_color': '#1976D2', 'outline_width': '0.5'
+        })
+        self._tpl_point_symbol.setColor(self.PREVIEW_COLOR_POINT)
+        self._tpl_bbox_symbol = QgsFillSymbol.createSimple({'color': '255,112,67,50', 'outline_width': '1.5'})
+        self._tpl_bbox_symbol.symbolLayer(0).setStrokeColor(self.PREVIEW_COLOR_BBOX)
+        self._tpl_polygon_symbol = QgsFillSymbol.createSimple({'color': '129,199,132,50', 'outline_width': '1.5'})
+        self._tpl_polygon_symbol.symbolLayer(0).setStrokeColor(self.PREVIEW_COLOR_POLYGON)
+        self._tpl_extract_symbol = QgsFillSymbol.createSimple({'outline_style': 'no', 'opacity': '0.7'})
+    
+    def _build_preview_layer(self, geom_type, geom_data, name):
+        """Build a preview layer without adding it to the project."""
         if geom_type == 'point':
             layer = QgsVectorLayer("Point?crs=EPSG:4326", f"[Preview] {name}", "memory")
             feature = QgsFeature()
-            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(geom_data['lon'], geom_data['lat'])))
-            symbol = QgsMarkerSymbol.createSimple({
-                'name': 'circle', 'color': self.PREVIEW_COLOR_POINT,
-                'size': '4', 'outline_color': '#1976D2', 'outline_width': '0.5'
-            })
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(geom_data.lon, geom_data.lat)))
+            symbol = self._tpl_point_symbol.clone()
         elif geom_type == 'bbox':
             layer = QgsVectorLayer("Polygon?crs=EPSG:4326", f"[Preview] {name}", "memory")
             feature = QgsFeature()
-            points = [
-                QgsPointXY(geom_data['min_lon'], geom_data['min_lat']),
-                QgsPointXY(geom_data['max_lon'], geom_data['min_lat']),
-                QgsPointXY(geom_data['max_lon'], geom_data['max_lat']),
-                QgsPointXY(geom_data['min_lon'], geom_data['max_lat']),
-            ]
-            feature.setGeometry(QgsGeometry.fromPolygonXY([points]))
-            symbol = QgsFillSymbol.createSimple({
-                'color': '255,112,67,50', 'outline_color': self.PREVIEW_COLOR_BBOX, 'outline_width': '1.5'
-            })
+            feature.setGeometry(QgsGeometry.fromRect(QgsRectangle(*geom_data)))
+            symbol = self._tpl_bbox_symbol.clone()
         elif geom_type == 'polygon':
             layer = QgsVectorLayer("Polygon?crs=EPSG:4326", f"[Preview] {name}", "memory")
             feature = QgsFeature()
-            points = [QgsPointXY(lon, lat) for lon, lat in geom_data['coords']]
-            feature.setGeometry(QgsGeometry.fromPolygonXY([points]))
-            symbol = QgsFillSymbol.createSimple({
-                'color': '129,199,132,50', 'outline_color': self.PREVIEW_COLOR_POLYGON, 'outline_width': '1.5'
-            })
+            # One WKT parse in C++ instead of a QgsPointXY wrapper per vertex
+            coords = geom_data.coords
+            ring = ",".join(f"{lon} {lat}" for lon, lat in coords)
+            feature.setGeometry(QgsGeometry.fromWkt(
+                f"POLYGON(({ring},{coords[0][0]} {coords[0][1]}))"
+            ))
+            symbol = self._tpl_polygon_symbol.clone()
         else:
             return None
         
-        layer.dataProvider().addFeature(feature)
+        # FastInsert skips fid bookkeeping; adding the layer schedules the repaint
+        layer.dataProvider().addFeatures([feature], QgsFeatureSink.FastInsert)
         layer.setRenderer(QgsSingleSymbolRenderer(symbol))
-        layer.triggerRepaint()
-        
-        QgsProject.instance().addMapLayer(layer)
-        self.preview_layers[layer.id()] = layer
-        return layer.id()
+        return layer
+    
+    def _commit_preview_layers(self, layers):
+        """Add built preview layers to the project in one call; returns their ids."""
+        QgsProject.instance().addMapLayers(layers)
+        layer_ids = []
+        for layer in layers:
+            self.preview_layers[layer.id()] = layer
+            layer_ids.append(layer.id())
+        return layer_ids
     
-    def _remove_preview_layer(self, layer_id):
-        """Remove preview layer from map."""
-        if layer_id and layer_id in self.preview_layers:
+    def _remove_preview_layers(self, layer_ids):
+        """Remove preview layers from the map in one project call; callers refresh."""
+        layer_ids = [layer_id for layer_id in layer_ids if layer_id in self.preview_layers]
+        for layer_id in layer_ids:
+            self._layer_to_item.pop(layer_id, None)
+        if layer_ids:
             try:
-                QgsProject.instance().removeMapLayer(layer_id)
-                self.canvas.refresh()
+                QgsProject.instance().removeMapLayers(layer_ids)
             except:
                 pass
-            if layer_id in self.preview_layers:
-                del self.preview_layers[layer_id]
-    
-    def _on_layer_removed_from_qgis(self, layer_id):
-        """Sync when layer is removed from QGIS."""
-        for i in range(self.list_geometries.count() - 1, -1, -1):
-            item = self.list_geometries.item(i)
-            if isinstance(item, GeometryItem) and item.layer_id == layer_id:
-                self.list_geometries.takeItem(i)
-                if layer_id in self.preview_layers:
-                    del self.preview_layers[layer_id]
-                break
+            for layer_id in layer_ids:
+                self.preview_layers.pop(layer_id, None)
+    
+    def _on_layers_removed_from_qgis(self, layer_ids):
+        """Sync when layers are removed from QGIS (one batched signal per removal)."""
+        for layer_id in layer_ids:
+            self._similarity_layer_ids.discard(layer_id)
+            self._zone_reference_layer_ids.discard(layer_id)
+            self.preview_layers.pop(layer_id, None)
+            item = self._layer_to_item.pop(layer_id, None)
+            if item is not None:
+                self.list_geometries.takeItem(self.list_geometries.row(item))
+        
+        # Release the cached extraction render along with its layer
+        if self._render_cache_layer is not None and self._render_cache_layer.id() in layer_ids:
+            self._clear_render_cache()
+            self._render_cache_layer = None
         
         if self.list_geometries.count() == 0:
             self.btn_run.setEnabled(False)
     
     def _deactivate_tool(self):
-        """Deactivate all map tools."""
-        if self.canvas.mapTool() in [self.point_tool, self.bbox_tool, self.polygon_tool, getattr(self, 'color_picker_tool', None)]:
-            self.canvas.unsetMapTool(self.canvas.mapTool())
+        """Deactivate our map tool, if one is active."""
+        tool = self._active_tool_obj
+        if tool is None:
+            return
         
+        self._active_tool_obj = None
         self.current_tool = None
-        if self.point_tool:
-            self.point_tool.deactivate()
-        if self.bbox_tool:
-            self.bbox_tool.deactivate()
-        if self.polygon_tool:
-            self.polygon_tool.deactivate()
-        if hasattr(self, 'color_picker_tool') and self.color_picker_tool:
-            self.color_picker_tool.deactivate()
+        # unsetMapTool deactivates the tool; if the user already switched to
+        # another map tool, the canvas has deactivated ours for us
+        if self.canvas.mapTool() is tool:
+            self.canvas.unsetMapTool(tool)
         
         self._set_status("Ready")
     
@@ -472,51 +679,58 @@ class SimilaritySearchWidget(QDockWidget):
         for t, btn in buttons.items():
             if t != tool_type:
                 btn.setChecked(False)
-                btn.setStyleSheet(self.STYLE_TOOL_NORMAL)
+                self._set_tool_role(btn, "normal")
         
-        if hasattr(self, 'btn_pick_color') and self.btn_pick_color:
-            try:
-                self.btn_pick_color.setChecked(False)
-            except RuntimeError:
-                self.btn_pick_color = None
+        if self._extract_tab is not None:
+            self.btn_pick_color.setChecked(False)
         
         if clicked_btn.isChecked():
-            clicked_btn.setStyleSheet(self.STYLE_TOOL_ACTIVE)
+            self._set_tool_role(clicked_btn, "active")
             self._activate_tool(tool_type)
         else:
-            clicked_btn.setStyleSheet(self.STYLE_TOOL_NORMAL)
+            self._set_tool_role(clicked_btn, "normal")
             self._deactivate_tool()
             
+    def _set_map_tool(self, tool):
+        self._active_tool_obj = tool
+        self.canvas.setMapTool(tool)
+    
+    def _set_tool_role(self, btn, role):
+        """Switch a tool button's look; repolish only when the role changes."""
+        if btn.property("toolRole") == role:
+            return
+        btn.setProperty("toolRole", role)
+        btn.style().unpolish(btn)
+        btn.style().polish(btn)
+    
     def _activate_tool(self, tool_type):
-        """Activate specific map tool."""
+        """Activate specific map tool, building each kind once and reusing it."""
         self._deactivate_tool()
         self.current_tool = tool_type
         
-        if tool_type == 'point':
-            self.point_tool = PointPickerTool(self.canvas)
-            self.point_tool.point_selected.connect(self._on_point_added)
-            self.canvas.setMapTool(self.point_tool)
-            self._set_status("Click on the map to add a point")
-        elif tool_type == 'bbox':
-            self.bbox_tool = BBoxPickerTool(self.canvas)
-            self.bbox_tool.bbox_selected.connect(self._on_bbox_added)
-            self.canvas.setMapTool(self.bbox_tool)
-            self._set_status("Draw a bounding box on the map")
-        elif tool_type == 'polygon':
-            self.polygon_tool = PolygonPickerTool(self.canvas)
-            self.polygon_tool.polygon_selected.connect(self._on_polygon_added)
-            self.canvas.setMapTool(self.polygon_tool)
-            self._set_status("Click vertices, right-click to finish")
+        tool_class, signal_name, slot, status = self._tool_factories[tool_type]
+        attr = f"{tool_type}_tool"
+        tool = getattr(self, attr)
+        if tool is None:
+            tool = tool_class(self.canvas)
+            getattr(tool, signal_name).connect(slot)
+            setattr(self, attr, tool)
+        
+        self._set_map_tool(tool)
+        self._set_status(status)
 
     def _on_pick_color_clicked(self):
         """Activate color picker tool."""
         for btn in [self.btn_point, self.btn_bbox, self.btn_polygon]:
             btn.setChecked(False)
-            btn.setStyleSheet(self.STYLE_TOOL_NORMAL)
+            self._set_tool_role(btn, "normal")
             
         if self.btn_pick_color.isChecked():
             self._deactivate_tool()
-            self.canvas.setMapTool(self.color_picker_tool)
+            if self.color_picker_tool is None:
+                self.color_picker_tool = ColorPickerTool(self.canvas)
+                self.color_picker_tool.color_picked.connect(self._on_color_picked_from_map)
+            self._set_map_tool(self.color_picker_tool)
             self._set_status("Click on map to pick a color")
         else:
             self._deactivate_tool()
@@ -531,61 +745,89 @@ class SimilaritySearchWidget(QDockWidget):
     
     def _get_next_name(self, geom_type):
         """Get next available name for geometry type."""
-        self.geometry_counter[geom_type] += 1
-        type_names = {'point': 'Point', 'bbox': 'BBox', 'polygon': 'Polygon'}
-        return f"{type_names[geom_type]} {self.geometry_counter[geom_type]}"
+        n = self.geometry_counter[geom_type] + 1
+        self.geometry_counter[geom_type] = n
+        return f"{self._TYPE_NAMES[geom_type]} {n}"
     
-    def _on_point_added(self, lon, lat):
-        name = self._get_next_name('point')
-        data = {'lon': lon, 'lat': lat}
-        layer_id = self._create_preview_layer('point', data, name)
-        item = GeometryItem('point', data, name, layer_id)
-        self.list_geometries.addItem(item)
+    def _add_geometries(self, geometries):
+        """Add (geom_type, geom_data) pairs to the list and map in one batch.
+        
+        All preview layers are registered with a single addMapLayers call, so
+        importing many geometries costs one canvas repaint. Returns the names.
+        """
+        names = [self._get_next_name(geom_type) for geom_type, _ in geometries]
+        layers = [
+            self._build_preview_layer(geom_type, geom_data, name)
+            for (geom_type, geom_data), name in zip(geometries, names)
+        ]
+        layer_ids = iter(self._commit_preview_layers([layer for layer in layers if layer is not None]))
+        
+        self.list_geometries.setUpdatesEnabled(False)
+        try:
+            for (geom_type, geom_data), name, layer in zip(geometries, names, layers):
+                layer_id = next(layer_ids) if layer is not None else None
+                item = GeometryItem(geom_type, geom_data, name, layer_id)
+                self.list_geometries.addItem(item)
+                if layer_id:
+                    self._layer_to_item[layer_id] = item
+        finally:
+            self.list_geometries.setUpdatesEnabled(True)
+        
         self.btn_run.setEnabled(True)
-        self._set_status(f"Added: {name} ({lon:.4f}, {lat:.4f})")
+        return names
+    
+    def _on_geometry_added(self, geom_type, geom_data, detail=""):
+        name = self._add_geometries([(geom_type, geom_data)])[0]
+        self._set_status(f"Added: {name}{detail}")
+    
+    def _on_point_added(self, lon, lat):
+        self._on_geometry_added('point', PointData(lon, lat), f" ({lon:.4f}, {lat:.4f})")
         
         # Auto-deactivate the Add Point button after adding a point
         if self.btn_point.isChecked():
             self.btn_point.setChecked(False)
-            self.btn_point.setStyleSheet(self.STYLE_TOOL_NORMAL)
+            self._set_tool_role(self.btn_point, "normal")
             self._deactivate_tool()
     
     def _on_bbox_added(self, min_lon, min_lat, max_lon, max_lat):
-        name = self._get_next_name('bbox')
-        data = {'min_lon': min_lon, 'min_lat': min_lat, 'max_lon': max_lon, 'max_lat': max_lat}
-        layer_id = self._create_preview_layer('bbox', data, name)
-        item = GeometryItem('bbox', data, name, layer_id)
-        self.list_geometries.addItem(item)
-        self.btn_run.setEnabled(True)
-        self._set_status(f"Added: {name}")
+        self._on_geometry_added('bbox', Bbox(min_lon, min_lat, max_lon, max_lat))
     
     def _on_polygon_added(self, coords):
-        name = self._get_next_name('polygon')
-        data = {'coords': coords}
-        layer_id = self._create_preview_layer('polygon', data, name)
-        item = GeometryItem('polygon', data, name, layer_id)
-        self.list_geometries.addItem(item)
-        self.btn_run.setEnabled(True)
-        self._set_status(f"Added: {name} ({len(coords)} vertices)")
+        self._on_geometry_added('polygon', PolyData(tuple(coords)), f" ({len(coords)} vertices)")
     
     def _on_geometry_renamed(self, item):
-        if isinstance(item, GeometryItem) and item.layer_id:
-            layer = QgsProject.instance().mapLayer(item.layer_id)
+        # The list only ever holds GeometryItems (see _add_geometries)
+        if item.layer_id:
+            self._pending_renames[item.layer_id] = item.geom_name
+            self._rename_timer.start()
+    
+    def _flush_renames(self):
+        project = QgsProject.instance()
+        for layer_id, name in self._pending_renames.items():
+            layer = project.mapLayer(layer_id)
             if layer:
-                layer.setName(f"[Preview] {item.geom_name}")
+                layer.setName(f"[Preview] {name}")
+        self._pending_renames.clear()
     
     def _on_clear_clicked(self):
         """Clear all geometries and preview layers."""
-        layer_ids_to_remove = []
-        for i in range(self.list_geometries.count()):
-            item = self.list_geometries.item(i)
-            if isinstance(item, GeometryItem) and item.layer_id:
-                layer_ids_to_remove.append(item.layer_id)
+        layer_ids_to_remove = [layer_id for layer_id in self._layer_to_item if layer_id in self.preview_layers]
         
+        self.list_geometries.setUpdatesEnabled(False)
+        self.list_geometries.blockSignals(True)
         self.list_geometries.clear()
+        self.list_geometries.blockSignals(False)
+        self.list_geometries.setUpdatesEnabled(True)
+        self._layer_to_item.clear()
         
-        for layer_id in layer_ids_to_remove:
-            self._remove_preview_layer(layer_id)
+        # One bulk removal and a single repaint instead of one per layer
+        self.canvas.setRenderFlag(False)
+        try:
+            QgsProject.instance().removeMapLayers(layer_ids_to_remove)
+            for layer_id in layer_ids_to_remove:
+                self.preview_layers.pop(layer_id, None)
+        finally:
+            self.canvas.setRenderFlag(True)
         
         self.canvas.refresh()
         self.geometry_counter = {'point': 0, 'bbox': 0, 'polygon': 0}
@@ -596,17 +838,30 @@ class SimilaritySearchWidget(QDockWidget):
         count = self.list_geometries.count()
         if count > 0:
             item = self.list_geometries.takeItem(count - 1)
-            if isinstance(item, GeometryItem):
-                self._remove_preview_layer(item.layer_id)
+            self._remove_preview_layers([item.layer_id])
+            self.canvas.refresh()
             self._set_status(f"Removed: {item.geom_name}")
             if self.list_geometries.count() == 0:
                 self.btn_run.setEnabled(False)
     
     def _on_remove_clicked(self):
-        for item in self.list_geometries.selectedItems():
-            if isinstance(item, GeometryItem):
-                self._remove_preview_layer(item.layer_id)
-            self.list_geometries.takeItem(self.list_geometries.row(item))
+        selected = self.list_geometries.selectedItems()
+        rows = sorted((self.list_geometries.row(item) for item in selected), reverse=True)
+        
+        # Take rows bottom-up so earlier indices stay valid, without per-row signals
+        layer_ids = []
+        self.list_geometries.setUpdatesEnabled(False)
+        self.list_geometries.blockSignals(True)
+        for row in rows:
+            item = self.list_geometries.takeItem(row)
+            layer_ids.append(item.layer_id)
+        self.list_geometries.blockSignals(False)
+        self.list_geometries.setUpdatesEnabled(True)
+        
+        if layer_ids:
+            self._remove_preview_layers(layer_ids)
+            self.canvas.refresh()
+        
         if self.list_geometries.count() == 0:
             self.btn_run.setEnabled(False)
     
@@ -616,6 +871,13 @@ class SimilaritySearchWidget(QDockWidget):
             self.iface.messageBar().pushWarning("QGIS Embeddings AI", "Please add at least one geometry.")
             return
         
+        if not _EE_AVAILABLE:
+            self.iface.messageBar().pushCritical("QGIS Embeddings AI", _EE_MISSING_MESSAGE)
+            return
+        
+        if self._search_thread is not None:
+            return
+        
         buffer_km = self.spin_buffer.value()
         max_threshold = self.spin_threshold.value()
         resolution = self.spin_resolution.value()
@@ -632,97 +894,164 @@ class SimilaritySearchWidget(QDockWidget):
         self._set_status("Running search...")
         self.btn_run.setEnabled(False)
         
-        items_to_process = []
-        for i in range(self.list_geometries.count()):
-            item = self.list_geometries.item(i)
-            if isinstance(item, GeometryItem):
-                items_to_process.append({
-                    'geom_type': item.geom_type,
-                    'geom_data': item.geom_data,
-                    'geom_name': item.geom_name,
-                    'layer_id': item.layer_id
-                })
+        # The index holds every listed geometry, in the order it was added
+        items_to_process = [
+            GeomTask(item.geom_type, item.geom_data, item.geom_name, item.layer_id)
+            for item in self._layer_to_item.values()
+        ]
         
+        self._search_context = {
+            'tasks': items_to_process,
+            'buffer_km': buffer_km,
+            'resolution': resolution,
+            'year_label': year_label,
+            'color_palette': color_palette,
+            # Final display parameters, shared by every similarity layer of the run
+            'vis_params': {'min': 0, 'max': max_threshold, 'palette': color_palette},
+        }
+        
+        # Earth Engine round-trips run on a worker thread so the dock keeps painting
+        worker = GEESearchWorker(self.gee_search, items_to_process, {
+            'buffer_km': buffer_km,
+            'year_start': year_start,
+            'year_end': year_end,
+            'max_threshold': max_threshold,
+            'resolution': resolution,
+        })
+        thread = QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.progress.connect(self._set_status)
+        worker.finished.connect(self._on_search_finished)
+        worker.error.connect(self._on_search_error)
+        worker.finished.connect(thread.quit)
+        worker.error.connect(thread.quit)
+        thread.finished.connect(worker.deleteLater)
+        thread.finished.connect(thread.deleteLater)
+        thread.finished.connect(self._on_search_thread_finished)
+        
+        self._search_thread = thread
+        self._search_worker = worker
+        thread.start()
+    
+    def _on_search_finished(self, results):
+        """Add the worker's results to the map (GUI thread)."""
+        context = self._search_context
+        tasks = context['tasks']
+        
+        # Suspend canvas rendering while result layers are injected so the canvas
+        # redraws once at the end rather than after every added layer
+        self.canvas.freeze(True)
+        self.canvas.setRenderFlag(False)
         try:
-            for item_data in items_to_process:
-                self._set_status(f"Processing: {item_data['geom_name']} ({year_label})...")
-                
-                result = self.gee_search.run_similarity_search_geometry(
-                    geom_type=item_data['geom_type'],
-                    geom_data=item_data['geom_data'],
-                    buffer_km=buffer_km,
-                    year_start=year_start,
-                    year_end=year_end,
-                    max_threshold=max_threshold
-                )
-                
+            self.last_search_params = {
+                'buffer_km': context['buffer_km'],
+                'resolution': context['resolution'],
+                'year': context['year_label'],
+                'color_palette': context['color_palette']
+            }
+            
+            # Failed geometries carry an 'error' entry; the rest are still added
+            succeeded = [(task, result) for task, result in zip(tasks, results) if 'error' not in result]
+            failed = [
+                f"{task.geom_name}: {result['error']}"
+                for task, result in zip(tasks, results) if 'error' in result
+            ]
+            
+            last_index = len(succeeded) - 1
+            for index, (task, result) in enumerate(succeeded):
                 # Store last result for export
                 self.last_search_result = result
-                self.last_search_name = item_data['geom_name']
-                self.last_search_params = {
-                    'buffer_km': buffer_km,
-                    'resolution': resolution,
-                    'year': year_label,
-                    'color_palette': color_palette
-                }
+                self.last_search_name = task.geom_name
                 
-                self._add_results_to_map(result, item_data['geom_name'], item_data['layer_id'], year_label, resolution, color_palette)
+                self._add_results_to_map(
+                    result, task.geom_name, task.layer_id, context['year_label'], context['vis_params'],
+                    center=index == last_index
+                )
             
-            self.btn_run.setEnabled(True)
-            self.btn_export.setEnabled(True)  # Enable export after successful search
-            self._set_status(f"Search completed ({len(items_to_process)} geometries)")
+            if succeeded:
+                self.btn_export.setEnabled(True)  # Enable export after successful search
+            if failed:
+                self.iface.messageBar().pushWarning("QGIS Embeddings AI", "Search failed for " + "; ".join(failed))
+            self._set_status(f"Search completed ({len(succeeded)} of {len(tasks)} geometries)")
             
         except Exception as e:
-            self.iface.messageBar().pushCritical("QGIS Embeddings AI", f"Error: {str(e)}")
-            self._set_status(f"Error: {str(e)}")
-            self.btn_run.setEnabled(True)
+            self._on_search_error(str(e))
+        finally:
+            self.canvas.setRenderFlag(True)
+            self.canvas.freeze(False)
+            self.canvas.refresh()
     
-    def _add_results_to_map(self, result, geom_name, preview_layer_id, year, resolution=30, color_palette=None):
-        """Add search results to QGIS map."""
-        try:
-            from ee_plugin import Map
-            import ee
-            
+    def _on_search_error(self, message):
+        self.iface.messageBar().pushCritical("QGIS Embeddings AI", f"Error: {message}")
+        self._set_status(f"Error: {message}")
+    
+    def _on_search_thread_finished(self):
+        self._search_thread = None
+        self._search_worker = None
+        self._search_context = None
+        # Only now does _on_run_clicked accept a new search
+        self.btn_run.setEnabled(self.list_geometries.count() > 0)
+    
+    def _add_results_to_map(self, result, geom_name, preview_layer_id, year, vis_params=None, center=True):
+        """Add search results to QGIS map.
+        
+        `vis_params` is the run's final display dict; it defaults to the result's own.
+        """
+        if not _EE_AVAILABLE:
+            raise RuntimeError(_EE_MISSING_MESSAGE)
+        
+        if center:
             Map.centerObject(result['search_area'], 12)
-            
-            # Search Zone layer removed per user request
-            # Map.addLayer(result['search_area'], {'color': 'red'}, f"[{geom_name}] Search Zone", True, 0.3)
-            Map.addLayer(result['reference_geom'], {'color': '#7a9bb8'}, f"[{geom_name}] Reference", True, 1.0)
-            
-            optimized_similarity = result['similarity_image'].reproject(crs='EPSG:4326', scale=resolution)
-            
-            vis_params = result['vis_params'].copy()
-            if color_palette:
-                vis_params['palette'] = color_palette
-            
-            Map.addLayer(optimized_similarity, vis_params, f"[{geom_name}] Similarity ({year})")
-            
-            if preview_layer_id:
-                try:
-                    QgsProject.instance().removeMapLayer(preview_layer_id)
-                except:
-                    pass
-            
-        except ImportError:
-            raise RuntimeError(
-                "Google Earth Engine plugin is required. "
-                "Please install from QGIS Plugin Manager and connect your Google Cloud Project."
-            )
+        
+        # Search Zone layer removed per user request
+        # Map.addLayer(result['search_area'], {'color': 'red'}, f"[{geom_name}] Search Zone", True, 0.3)
+        reference_name = f"[{geom_name}] Reference"
+        Map.addLayer(result['reference_geom'], {'color': '#7a9bb8'}, reference_name, True, 1.0)
+        self._track_layers(reference_name, self._zone_reference_layer_ids)
+        
+        similarity_name = f"[{geom_name}] Similarity ({year})"
+        # Already reprojected to the search resolution by the batch (display_image)
+        Map.addLayer(result['display_image'], vis_params or result['vis_params'], similarity_name)
+        self._track_layers(similarity_name, self._similarity_layer_ids)
+        
+        if preview_layer_id:
+            try:
+                QgsProject.instance().removeMapLayer(preview_layer_id)
+            except:
+                pass
+    
+    def _track_layers(self, name, layer_ids):
+        """Record the ids of project layers called `name` (Map.addLayer returns none)."""
+        layer_ids.update(layer.id() for layer in QgsProject.instance().mapLayersByName(name))
     
     def _set_status(self, message):
-        self.label_status.setText(f"Status: {message}")
+        self._pending_status = message
+        if not self._status_timer.isActive():
+            self._status_timer.start()
+    
+    def _flush_status(self):
+        """Show the latest pending status now (also used before forced repaints)."""
+        self._status_timer.stop()
+        if self._pending_status is not None:
+            # QLabel.setText is a no-op for unchanged text, so repeats cost no repaint
+            self.label_status.setText(f"Status: {self._pending_status}")
+            self._pending_status = None
     
     def _on_toggle_similarity_clicked(self):
         """Toggle visibility of Zone and Reference layers."""
         show_only_similarity = self.btn_toggle_similarity.isChecked()
         
-        for layer in QgsProject.instance().mapLayers().values():
-            name = layer.name()
-            if "] Search Zone" in name or "] Reference" in name:
-                root = QgsProject.instance().layerTreeRoot()
-                layer_node = root.findLayer(layer.id())
+        root = QgsProject.instance().layerTreeRoot()
+        # Freeze the canvas so k visibility changes cost a single redraw
+        self.canvas.freeze(True)
+        try:
+            for layer_id in self._zone_reference_layer_ids:
+                layer_node = root.findLayer(layer_id)
                 if layer_node:
                     layer_node.setItemVisibilityChecked(not show_only_similarity)
+        finally:
+            self.canvas.freeze(False)
         
         if show_only_similarity:
             self.btn_toggle_similarity.setText("Show All Layers")
@@ -734,25 +1063,46 @@ class SimilaritySearchWidget(QDockWidget):
         self.canvas.refresh()
     
     def _on_tolerance_changed(self, value):
-        self.label_tolerance.setText(f"{value}%")
+        self.label_tolerance.setText(f"{value}%" if value else "Exact")
     
     def _refresh_similarity_layers(self):
-        self.combo_similarity_layer.clear()
-        for layer in QgsProject.instance().mapLayers().values():
-            if "] Similarity" in layer.name():
-                self.combo_similarity_layer.addItem(layer.name(), layer.id())
-        
-        if self.combo_similarity_layer.count() == 0:
-            self.combo_similarity_layer.addItem("No similarity layers found")
+        """Patch the layer combo against the tracked similarity layers.
+        
+        Only missing or stale entries are removed and new ones inserted, so the
+        current selection survives and the view is not rebuilt on every refresh.
+        """
+        self._ensure_extract_tab()
+        combo = self.combo_similarity_layer
+        project = QgsProject.instance()
+        desired = {}
+        for layer_id in self._similarity_layer_ids:
+            layer = project.mapLayer(layer_id)
+            if layer is not None:
+                desired[layer_id] = layer.name()
+        ordered = sorted(desired, key=lambda layer_id: (desired[layer_id], layer_id))
+        
+        combo.blockSignals(True)
+        try:
+            # Bottom-up so indices stay valid; drops the placeholder (no data) too
+            for i in range(combo.count() - 1, -1, -1):
+                layer_id = combo.itemData(i)
+                if layer_id not in desired or combo.itemText(i) != desired[layer_id]:
+                    combo.removeItem(i)
+            
+            # Surviving items are already in name order; merge the new ones in
+            for i, layer_id in enumerate(ordered):
+                if combo.itemData(i) != layer_id:
+                    combo.insertItem(i, desired[layer_id], layer_id)
+            
+            if combo.count() == 0:
+                combo.addItem("No similarity layers found")
+        finally:
+            combo.blockSignals(False)
     
     def _on_extract_clicked(self):
         """Extract polygons from similarity layer based on color matching."""
+        self._ensure_extract_tab()
         try:
-            import processing
-            from qgis.core import QgsProcessingFeedback
-            import tempfile
-            import os
-            
             layer_id = self.combo_similarity_layer.currentData()
             if not layer_id:
                 self._refresh_similarity_layers()
@@ -771,118 +1121,182 @@ class SimilaritySearchWidget(QDockWidget):
             
             canvas = self.iface.mapCanvas()
             extent = canvas.extent()
-            temp_dir = tempfile.gettempdir()
-            
-            from qgis.core import QgsMapRendererParallelJob
-            from qgis.PyQt.QtGui import QImage
-            from qgis.PyQt.QtCore import QSize
             
             settings = canvas.mapSettings()
-            settings.setLayers([layer])
-            settings.setExtent(extent)
             
             canvas_size = self.iface.mapCanvas().size()
             width = canvas_size.width()
             height = canvas_size.height()
             
-            max_dim = 2000
+            max_dim = self.combo_extract_quality.currentData() or self.EXTRACT_MAX_DIM
             if width > max_dim or height > max_dim:
                 scale = min(max_dim/width, max_dim/height)
                 width = int(width * scale)
                 height = int(height * scale)
             
-            settings.setBackgroundColor(QColor(0, 0, 0, 0))
-            settings.setOutputSize(QSize(width, height))
-            settings.setExtent(extent)
-            
-            job = QgsMapRendererParallelJob(settings)
-            job.start()
-            job.waitForFinished()
+            # Rendering finer than the raster's own pixels only upsamples it
+            native_pixel = self._native_pixel_size(layer, settings.destinationCrs())
+            if native_pixel is not None:
+                scale = min(extent.width() / native_pixel[0] / width, extent.height() / native_pixel[1] / height)
+                if scale < 1:
+                    width = max(1, math.ceil(width * scale))
+                    height = max(1, math.ceil(height * scale))
             
-            image = job.renderedImage()
             r_target, g_target, b_target = target_color.red(), target_color.green(), target_color.blue()
             
-            self._set_status("Vectorizing...")
-            
-            from osgeo import gdal, osr
+            # NumPy, GDAL and the optional OpenCV/Numba backends load with the first
+            # extraction rather than with the dock; later calls are a dict lookup
             import numpy as np
+            from .extract_tool import (
+                perceptual_match_mask, paletted_raster_mask, open_mask, polygonize_features,
+                color_distance_map, clean_distance_mask,
+            )
             
-            driver = gdal.GetDriverByName('GTiff')
-            out_raster_path = os.path.join(temp_dir, "alpha_earth_mask.tif")
-            out_ds = driver.Create(out_raster_path, width, height, 1, gdal.GDT_Byte)
-            
+            crs = settings.destinationCrs()
             pixel_width = extent.width() / width
             pixel_height = extent.height() / height
             geo_transform = [extent.xMinimum(), pixel_width, 0, extent.yMaximum(), 0, -pixel_height]
-            out_ds.SetGeoTransform(geo_transform)
-            
-            srs = osr.SpatialReference()
-            srs.ImportFromWkt(settings.destinationCrs().toWkt())
-            out_ds.SetProjection(srs.ExportToWkt())
-            
-            raster_data = np.zeros((height, width), dtype=np.uint8)
             
             slider_val = self.slider_color_tolerance.value()
-            threshold_dist = (slider_val / 100.0) * 200.0 + 10.0
-            threshold_sq = threshold_dist ** 2
-            
-            matched_pixels = 0
-            for x in range(width):
-                for y in range(height):
-                    pixel = image.pixel(x, y)
-                    
-                    if (pixel >> 24) & 0xFF == 0:
-                        continue
-                    
-                    r = (pixel >> 16) & 0xFF
-                    g = (pixel >> 8) & 0xFF
-                    b = pixel & 0xFF
-                    
-                    dist_sq = (r - r_target)**2 + (g - g_target)**2 + (b - b_target)**2
-                    
-                    if dist_sq <= threshold_sq:
-                        raster_data[y, x] = 1
-                        matched_pixels += 1
-            
-            out_band = out_ds.GetRasterBand(1)
-            out_band.WriteArray(raster_data)
-            out_band.FlushCache()
-            out_ds = None
-            
-            output_vector = os.path.join(temp_dir, "alpha_earth_polygons.gpkg")
-            
-            params = {
-                'INPUT': out_raster_path, 'BAND': 1, 'FIELD': 'value',
-                'EIGHT_CONNECTEDNESS': False, 'EXTRA': '', 'OUTPUT': output_vector
-            }
-            
-            result = processing.run("gdal:polygonize", params)
+            # 0 is an exact match; otherwise distances span 12..210
+            threshold_dist = (slider_val / 100.0) * 200.0 + 10.0 if slider_val else 0.0
+            target_rgb = (r_target, g_target, b_target)
+            open_size = self.spin_open_size.value()
             
-            if result and 'OUTPUT' in result:
-                vector_path = result['OUTPUT']
-                vlayer = QgsVectorLayer(vector_path, f"Extracted [{matched_pixels} px]", "ogr")
-                
-                if vlayer.isValid():
-                    vlayer.setSubsetString("value = 1")
-                    symbol = QgsFillSymbol.createSimple({
-                        'color': self.color_extract.color().name(),
-                        'outline_style': 'no', 'opacity': '0.7'
-                    })
-                    vlayer.renderer().setSymbol(symbol)
-                    
-                    QgsProject.instance().addMapLayer(vlayer)
-                    self._set_status(f"Created polygons from {matched_pixels} pixels")
-                    self.iface.messageBar().pushSuccess("QGIS Embeddings AI", "Extraction complete!")
-                else:
-                    self._set_status("Error loading vector result")
-            else:
-                self._set_status("Polygonize failed")
-                
+            # Layer access stays on the GUI thread: local paletted rasters are read
+            # directly, everything else is rendered into an array
+            raster_data = paletted_raster_mask(layer, extent, crs, width, height, target_rgb, threshold_dist)
+            bgra = distance = None
+            if raster_data is None:
+                bgra = self._render_layer_bgra(layer, settings, extent, width, height)
+                # Same render and color as last time (only the tolerance moved):
+                # reuse the distance map and just threshold it again
+                cached = self._distance_cache
+                if cached is not None and cached[0] is bgra and cached[1] == target_rgb:
+                    distance = cached[2]
         except Exception as e:
-            self.iface.messageBar().pushCritical("QGIS Embeddings AI", f"Error extracting polygons: {str(e)}")
-            self._set_status(f"Error: {str(e)}")
-            import traceback
-            QgsMessageLog.logMessage(traceback.format_exc(), "QGIS Embeddings AI", Qgis.Critical)
+            self._on_extract_failed(e)
+            return
+        
+        def run(task):
+            # Worker thread: arrays and features only, no layers or widgets
+            computed = None
+            if raster_data is not None:
+                mask = open_mask(raster_data, open_size)
+            elif threshold_dist < 1:
+                mask = open_mask(perceptual_match_mask(bgra, target_rgb, threshold_dist), open_size)
+            else:
+                computed = distance if distance is not None else color_distance_map(bgra, target_rgb)
+                mask = clean_distance_mask(computed, threshold_dist, open_size)
+            if task.isCanceled():
+                return None
+            task.setProgress(50)
+            return int(np.count_nonzero(mask)), polygonize_features(mask, geo_transform, crs), computed
+        
+        def finished(exception, result=None):
+            if task is not self._extract_task:
+                return  # superseded or shut down
+            self._extract_task = None
+            self.btn_extract.setEnabled(True)
+            if task.isCanceled():
+                self._set_status("Extraction canceled")
+            elif exception is not None:
+                self._on_extract_failed(exception)
+            else:
+                matched_pixels, features, computed = result
+                if computed is not None and self._render_cache is not None and self._render_cache[1] is bgra:
+                    self._distance_cache = (bgra, target_rgb, computed)
+                self._add_extracted_layer(matched_pixels, features, crs, target_color)
+        
+        task = QgsTask.fromFunction("Extract polygons", run, on_finished=finished)
+        # Keep a reference: PyQGIS drops tasks that are only owned by the manager
+        self._extract_task = task
+        self.btn_extract.setEnabled(False)
+        QgsApplication.taskManager().addTask(task)
+    
+    def _add_extracted_layer(self, matched_pixels, features, crs, target_color):
+        from .extract_tool import polygon_layer
+        
+        vlayer = polygon_layer(features, crs, f"Extracted [{matched_pixels} px]")
+        if vlayer.isValid():
+            symbol = self._tpl_extract_symbol.clone()
+            symbol.setColor(target_color)
+            vlayer.renderer().setSymbol(symbol)
+            
+            QgsProject.instance().addMapLayer(vlayer)
+            self._set_status(f"Created polygons from {matched_pixels} pixels")
+            self.iface.messageBar().pushSuccess("QGIS Embeddings AI", "Extraction complete!")
+        else:
+            self._set_status("Error loading vector result")
+    
+    def _on_extract_failed(self, error):
+        self.iface.messageBar().pushCritical("QGIS Embeddings AI", f"Error extracting polygons: {str(error)}")
+        self._set_status(f"Error: {str(error)}")
+        import traceback
+        QgsMessageLog.logMessage(
+            "".join(traceback.format_exception(type(error), error, error.__traceback__)),
+            "QGIS Embeddings AI", Qgis.Critical
+        )
+    
+    def _native_pixel_size(self, layer, crs):
+        """Size of one source pixel in `crs` units, or None if the layer has no fixed grid."""
+        if layer.type() != QgsMapLayerType.RasterLayer:
+            return None
+        provider = layer.dataProvider()
+        # Tiled web services report no size; their resolution follows the zoom
+        if provider is None or not provider.capabilities() & QgsRasterDataProvider.Size or layer.width() <= 0:
+            return None
+        
+        layer_extent = layer.extent()
+        if layer.crs() != crs:
+            try:
+                transform = QgsCoordinateTransform(layer.crs(), crs, QgsProject.instance())
+                layer_extent = transform.transformBoundingBox(layer_extent)
+            except QgsCsException:
+                return None
+        return layer_extent.width() / layer.width(), layer_extent.height() / layer.height()
+    
+    def _render_layer_bgra(self, layer, settings, extent, width, height):
+        """Render `layer` alone over `extent` into a BGRA array, reusing the previous
+        render when nothing changed (e.g. re-extracting with another color or tolerance)."""
+        key = (layer.id(), extent.toString(5), width, height, settings.destinationCrs().authid())
+        if self._render_cache is not None and self._render_cache[0] == key:
+            return self._render_cache[1]
+        
+        from .extract_tool import render_to_bgra
+        
+        settings.setLayers([layer])
+        settings.setBackgroundColor(QColor(0, 0, 0, 0))
+        settings.setOutputSize(QSize(width, height))
+        # One image pixel per output pixel, so the mask matches the geotransform
+        settings.setDevicePixelRatio(1)
+        settings.setExtent(extent)
+        
+        bgra = render_to_bgra(settings)
+        
+        self._watch_render_cache_layer(layer)
+        self._render_cache = (key, bgra)
+        self._distance_cache = None
+        return bgra
+    
+    def _watch_render_cache_layer(self, layer):
+        """Drop the cached render whenever the cached layer's look changes."""
+        if self._render_cache_layer is layer:
+            return
+        if self._render_cache_layer is not None:
+            try:
+                for signal in (self._render_cache_layer.rendererChanged, self._render_cache_layer.styleChanged,
+                               self._render_cache_layer.dataChanged):
+                    signal.disconnect(self._clear_render_cache)
+            except (RuntimeError, TypeError):
+                pass
+        for signal in (layer.rendererChanged, layer.styleChanged, layer.dataChanged):
+            signal.connect(self._clear_render_cache)
+        self._render_cache_layer = layer
+    
+    def _clear_render_cache(self):
+        self._render_cache = None
+        self._distance_cache = None
     
     def _on_export_clicked(self):
         """Open export dialog and download results."""
@@ -952,6 +1366,7 @@ class SimilaritySearchWidget(QDockWidget):
         
         self._set_status("Exporting... (this may take 10-30 seconds)")
         self.btn_export.setEnabled(False)
+        self._flush_status()
         self.iface.mainWindow().repaint()  # Force UI update
         
         try:
@@ -1074,9 +1489,36 @@ class SimilaritySearchWidget(QDockWidget):
             print(f"File size: {file_size} bytes")
 
     
+    def shutdown(self):
+        """Stop background work before the dock is destroyed, without blocking unload
+        on a slow Earth Engine request."""
+        if self._basemap_probes:
+            self._finish_basemap_probes()
+        if self._extract_task is not None:
+            task, self._extract_task = self._extract_task, None
+            task.cancel()
+        if self._search_thread is not None:
+            thread, worker = self._search_thread, self._search_worker
+            self._search_thread = self._search_worker = self._search_context = None
+            # Nothing may reach the dock once it is torn down
+            for signal, slot in ((worker.progress, self._set_status), (worker.finished, self._on_search_finished),
+                                 (worker.error, self._on_search_error),
+                                 (thread.finished, self._on_search_thread_finished)):
+                try:
+                    signal.disconnect(slot)
+                except (RuntimeError, TypeError):
+                    pass
+            thread.quit()
+            if not thread.wait(self.SHUTDOWN_WAIT_MS):
+                # Still inside an Earth Engine call: detach the thread from the dock
+                # and keep it alive until it ends (it deletes itself on finish)
+                thread.setParent(None)
+                _detached_threads.add(thread)
+                thread.finished.connect(lambda: _detached_threads.discard(thread))
+    
     def closeEvent(self, event):
         self._deactivate_tool()
         for btn in [self.btn_point, self.btn_bbox, self.btn_polygon]:
             btn.setChecked(False)
-            btn.setStyleSheet(self.STYLE_TOOL_NORMAL)
+            self._set_tool_role(btn, "normal")
         super().closeEvent(event)